@@ -0,0 +1,91 @@
+"""
+Measures how long ditto takes to start, which editor integrations pay on
+every action. Prints the time spent importing each module the command line
+entry point imports, in the format of python -X importtime (self and
+cumulative microseconds, nested imports indented), followed by the best wall
+time of running a few commands in a fresh interpreter. -X importtime needs
+Python 3.7 and ditto runs on Python 2, so the imports are timed with an
+import hook instead. Run from the repository root:
+
+    python benchmarks/import_time.py [folder containing .issue-config.json]
+
+Without a tracker folder only the commands that do not load a project are
+run.
+"""
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)),"..")
+REPEAT = 5
+
+#Run in a fresh interpreter: wraps __import__ to time every module loaded
+#while importing the entry point, then prints the timings
+IMPORT_HOOK = r"""
+import sys, time, __builtin__
+sys.path.insert(0,%(root)r)
+original_import = __builtin__.__import__
+stack = []
+timings = []
+def candidates(name,globals,level):
+    #the module names an import statement can load, relative first
+    if level != 0 and globals and "__name__" in globals:
+        package = globals["__name__"] if "__path__" in globals else globals["__name__"].rpartition(".")[0]
+        if package:
+            return [package+"."+name,name]
+    return [name]
+def timed_import(name,globals=None,locals=None,fromlist=None,level=-1):
+    new = [module for module in candidates(name,globals,level) if sys.modules.get(module) is None]
+    stack.append(0.0)
+    start = time.time()
+    try:
+        return original_import(name,globals,locals,fromlist,level)
+    finally:
+        elapsed = time.time() - start
+        children = stack.pop()
+        loaded = [module for module in new if sys.modules.get(module) is not None]
+        if loaded:
+            timings.append((elapsed - children,elapsed,len(stack),loaded[0]))
+            if stack:
+                stack[-1] += elapsed
+__builtin__.__import__ = timed_import
+import ditto.cli
+__builtin__.__import__ = original_import
+print("import time: self [us] | cumulative | imported package")
+for self_time, cumulative, depth, name in timings:
+    print("import time: %%9d | %%10d | %%s%%s" %% (self_time*1e6,cumulative*1e6,"  "*depth,name))
+print("total: %%d modules, %%d us" %% (len(timings),sum(timing[0] for timing in timings)*1e6))
+"""
+
+RUN_DITTO = "import sys; sys.path.insert(0,%r); sys.argv = ['ditto']+sys.argv[1:]; from ditto import cli; cli.main()" % ROOT
+
+def best_run(command,cwd):
+    """Best wall time of REPEAT runs of command"""
+    devnull = open(os.devnull,'w')
+    best = None
+    try:
+        for i in range(REPEAT):
+            start = time.time()
+            subprocess.call(command,cwd=cwd,stdout=devnull,stderr=devnull)
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best,elapsed)
+    finally:
+        devnull.close()
+    return best
+
+def main():
+    tracker = os.path.abspath(sys.argv[1]) if len(sys.argv) > 1 else None
+    subprocess.call([sys.executable,"-c",IMPORT_HOOK % {"root":ROOT}])
+    print("")
+    runs = [("interpreter only",[sys.executable,"-c","pass"])]
+    ditto = [sys.executable,"-c",RUN_DITTO]
+    runs.append(("ditto help",ditto+["help"]))
+    if tracker is not None:
+        runs.append(("ditto list",ditto+["list","-d","a"]))
+        runs.append(("ditto list-releases",ditto+["list-releases"]))
+    for label, command in runs:
+        print("%-22s %8.1f ms" % (label,best_run(command,tracker or ROOT)*1000))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Compares serial and parallel cold loads (no index) of trackers of increasing
+size, to find the number of issue files from which a process pool pays off
+(issues.PARALLEL_LOAD_THRESHOLD). Run from the repository root:
+
+    python benchmarks/parallel_load.py [workers]
+"""
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+from ditto import issues, cache
+from tracker import write_tracker
+
+SIZES = [250,500,1000,2000,4000,8000]
+EVENTS_PER_ISSUE = 20
+REPEAT = 3
+
+def cold_load(root,workers):
+    """Returns the best time of REPEAT loads without an index, and the
+    resulting issue order and names"""
+    config_path = os.path.join(root,".issue-config.json")
+    config = json.load(open(config_path))
+    config["load_workers"] = workers
+    config["parallel_load_threshold"] = 0
+    json.dump(config,open(config_path,'w'))
+    index_path = os.path.join(root,cache.INDEX_FILE)
+    best = None
+    for i in range(REPEAT):
+        if os.path.exists(index_path):
+            os.remove(index_path)
+        start = time.time()
+        project = issues.Project(root)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best,elapsed)
+    return best, [(issue._guid,issue.name) for issue in project._issues]
+
+def main():
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else multiprocessing.cpu_count()
+    print("workers: %d, events per issue: %d" % (workers,EVENTS_PER_ISSUE))
+    print("%8s %10s %10s %8s" % ("issues","serial(s)","parallel(s)","speedup"))
+    crossover = None
+    for size in SIZES:
+        root = tempfile.mkdtemp(prefix="ditto-bench-")
+        try:
+            write_tracker(root,issues=size,events_per_issue=EVENTS_PER_ISSUE)
+            serial, serial_names = cold_load(root,0)
+            parallel, parallel_names = cold_load(root,workers)
+            assert serial_names == parallel_names, "parallel load changed issue order or names"
+        finally:
+            shutil.rmtree(root)
+        print("%8d %10.3f %10.3f %8.2f" % (size,serial,parallel,serial/parallel))
+        if crossover is None and parallel < serial*0.95:
+            crossover = size
+    print("crossover: %s" % (crossover if crossover is not None else "not reached"))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Times the common operations on a synthetic tracker (see tracker.py) and
+writes the results as json, so runs on different revisions or machines can
+be compared. Run from the repository root:
+
+    python benchmarks/suite.py [--issues N] [--releases N] [--owners N]
+        [--events N] [--seed N] [--repeat N] [--output FILE]
+
+Each command is run in this process through command.execute_command, with
+its output discarded, on a freshly loaded project, so its time includes
+loading the project from a warm index but not starting the interpreter
+(benchmarks/import_time.py measures that). Commands that change the tracker
+run on a fresh copy every time. The best, mean and all run times are
+reported in seconds.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+from ditto import issues, cache, command
+from tracker import write_tracker
+
+#name, argv, whether the command changes the tracker
+BENCHMARKS = [
+    ("list",["list","-d","a"],False),
+    ("release-summary console",["release-summary","-r","1.0","-f","console"],False),
+    ("release-summary dokuwiki",["release-summary","-r","1.0","-f","dokuwiki"],False),
+    ("get-guid",["get-guid","-n","t_1"],False),
+    ("close",["close","-n","t_1","-t","2"],True),
+    ("number-issues",["number-issues"],True),
+    ]
+
+def summary(times):
+    return {"best":min(times),"mean":sum(times)/len(times),"runs":times}
+
+def load(root,cold):
+    """Seconds to load the project in root, without the index if cold"""
+    index_path = os.path.join(root,cache.INDEX_FILE)
+    if cold and os.path.exists(index_path):
+        os.remove(index_path)
+    start = time.time()
+    issues.Project(root)
+    return time.time() - start
+
+def run(root,argv):
+    """Seconds to load the project in root and run argv on it"""
+    devnull = open(os.devnull,'w')
+    stdout = sys.stdout
+    cwd = os.getcwd()
+    issues.set_project(None)
+    os.chdir(root)
+    sys.stdout = devnull
+    try:
+        start = time.time()
+        command.execute_command(argv)
+        return time.time() - start
+    finally:
+        sys.stdout = stdout
+        os.chdir(cwd)
+        issues.set_project(None)
+        devnull.close()
+
+def fresh_copy(pristine,work):
+    if os.path.exists(work):
+        shutil.rmtree(work)
+    shutil.copytree(pristine,work)
+    return work
+
+def main():
+    parser = argparse.ArgumentParser(description="Times ditto commands on a synthetic tracker")
+    parser.add_argument("--issues",type=int,default=1000)
+    parser.add_argument("--releases",type=int,default=10)
+    parser.add_argument("--owners",type=int,default=5)
+    parser.add_argument("--events",type=int,default=10,help="events per issue")
+    parser.add_argument("--seed",type=int,default=1)
+    parser.add_argument("--repeat",type=int,default=5)
+    parser.add_argument("--output",help="file to write the results to instead of standard output")
+    args = parser.parse_args()
+
+    #commands must fail rather than wait for input
+    command.interactive = False
+    temp = tempfile.mkdtemp(prefix="ditto-bench-")
+    try:
+        pristine = os.path.join(temp,"pristine")
+        work = os.path.join(temp,"work")
+        write_tracker(pristine,args.issues,args.releases,args.owners,args.events,args.seed)
+        #build the index once so the pristine tracker loads warm
+        load(pristine,False)
+
+        results = {}
+        results["load cold"] = summary([load(fresh_copy(pristine,work),True) for i in range(args.repeat)])
+        results["load warm"] = summary([load(pristine,False) for i in range(args.repeat)])
+        for name, argv, changes in BENCHMARKS:
+            times = []
+            for i in range(args.repeat):
+                times.append(run(fresh_copy(pristine,work) if changes else pristine,argv))
+            results[name] = summary(times)
+    finally:
+        shutil.rmtree(temp)
+
+    report = {
+        "python":platform.python_version(),
+        "platform":platform.platform(),
+        "tracker":{"issues":args.issues,"releases":args.releases,"owners":args.owners,
+            "events_per_issue":args.events,"seed":args.seed},
+        "repeat":args.repeat,
+        "results":results,
+        }
+    output = open(args.output,'w') if args.output else sys.stdout
+    try:
+        json.dump(report,output,indent=4,sort_keys=True)
+        output.write("\n")
+    finally:
+        if args.output:
+            output.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Generates synthetic trackers in ditto's on disk format for the benchmarks.
+The same arguments and seed always give the same issues. Can also be run on
+its own to create a tracker to try commands on:
+
+    python benchmarks/tracker.py FOLDER [--issues N] [--releases N]
+        [--owners N] [--events N] [--seed N]
+"""
+import argparse
+import json
+import os
+import random
+import uuid
+from datetime import datetime, timedelta
+
+USER = "bench (Bench) <bench@example.com>"
+
+def write_tracker(root,issues=1000,releases=10,owners=5,events_per_issue=10,seed=1):
+    """
+    Creates a tracker in root (which must not exist yet) with the given
+    number of issues, releases and owners. Every issue starts with a title,
+    description, estimate, release, owner and state event, then gets more
+    changes of owner, release, estimate and state up to events_per_issue
+    events. About half of the issues end up closed with an actual time. The
+    config makes the tracker its own master name server so number-issues
+    can run on it.
+    """
+    rng = random.Random(seed)
+    folder = os.path.join(root,".issues")
+    os.makedirs(folder)
+    json.dump({"folder":".issues","username":"bench","name":"Bench","email":"bench@example.com",
+        "is_master_name_server":"yes","master_name_server":"bench"},
+        open(os.path.join(root,".issue-config.json"),'w'))
+    json.dump({"project_name":"bench","started":"2011-01-01 00:00:00"},
+        open(os.path.join(folder,"project.json"),'w'),indent=4)
+
+    release_names = ["%d.%d" % (1+i/10,i%10) for i in range(releases)]
+    for name in release_names:
+        json.dump({"name":name,"description":"Release %s" % name},
+            open(os.path.join(folder,"release-%s.json" % _guid(rng)),'w'),indent=4)
+    owner_names = ["owner%d" % i for i in range(owners)]
+
+    timestamp = datetime(2011,1,1)
+    for i in xrange(issues):
+        events = []
+        #values are strings on disk, Issue.set_value stores str(value)
+        def add(key,value):
+            events.append({"key":key,"value":value,"user":USER,"timestamp":str(timestamp)})
+        add("title","Issue %d %s" % (i,rng.choice(["crash","slow","typo","feature","cleanup"])))
+        add("description","Description of issue %d\nwith a second line" % i)
+        add("estimate",str(float(rng.randint(1,16))))
+        add("release",rng.choice(release_names+[""]))
+        add("owner",rng.choice(owner_names+[""]))
+        add("state","open")
+        closed = rng.random() < 0.5
+        while len(events) < events_per_issue - (2 if closed else 0):
+            timestamp += timedelta(seconds=rng.randint(1,600))
+            key = rng.choice(["owner","release","estimate","state"])
+            if key == "owner":
+                add(key,rng.choice(owner_names+[""]))
+            elif key == "release":
+                add(key,rng.choice(release_names+[""]))
+            elif key == "estimate":
+                add(key,str(float(rng.randint(1,16))))
+            else:
+                add(key,"open")
+        if closed:
+            add("state","closed")
+            add("actual",str(float(rng.randint(1,24))))
+        json.dump(events,open(os.path.join(folder,"issue-%s.json" % _guid(rng)),'w'),indent=4)
+        timestamp += timedelta(seconds=rng.randint(60,3600))
+
+def _guid(rng):
+    """A uuid drawn from rng, so file names are reproducible too"""
+    return str(uuid.UUID(int=rng.getrandbits(128),version=1))
+
+def main():
+    parser = argparse.ArgumentParser(description="Creates a synthetic ditto tracker")
+    parser.add_argument("folder")
+    parser.add_argument("--issues",type=int,default=1000)
+    parser.add_argument("--releases",type=int,default=10)
+    parser.add_argument("--owners",type=int,default=5)
+    parser.add_argument("--events",type=int,default=10,help="events per issue")
+    parser.add_argument("--seed",type=int,default=1)
+    args = parser.parse_args()
+    write_tracker(args.folder,args.issues,args.releases,args.owners,args.events,args.seed)
+
+if __name__ == "__main__":
+    main()
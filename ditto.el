@@ -3,6 +3,9 @@
 ;; this is heavily based on ditz.el, and most functionality is not complete yet
 
 ;; Customizable variables
+(require 'json)
+(require 'ansi-color)
+
 (defcustom ditto-program "ditto"
   "Ditto command"
   :type 'string
@@ -23,6 +26,13 @@ must set it from minibuffer."
   :type 'boolean
   :group 'ditto)
 
+(defcustom ditto-use-daemon t
+  "If non-nil, commands are sent to the `ditto serve' daemon of the
+issue directory when one is running instead of starting a new ditto
+process for each."
+  :type 'boolean
+  :group 'ditto)
+
 ;; Constant variables
 (defconst ditto-issue-id-regex "^[^m]*m\\([^\t]*\\).*$"
   "Regex for issue id.")
@@ -256,7 +266,7 @@ must set it from minibuffer."
 (defun ditto-get-issue-guid (n)
   "works in the todo view or in the issue view"
   (let ((issue-id (ditto-extract-thing-at-point ditto-issue-id-regex 1)))
-    (shell-command-to-string (ditto-build-command "get-guid" (concat "-n" issue-id)))))
+    (ditto-command-output "get-guid" (concat "-n" issue-id))))
 
 (defun ditto-extract-thing-at-point (regex n)
   (save-excursion
@@ -303,29 +313,83 @@ must set it from minibuffer."
       (erase-buffer)
       (buffer-disable-undo (current-buffer)))
 
-    (make-comint-in-buffer "ditto-call-process"
-                           buffer shell-file-name nil shell-command-switch
-                           (ditto-build-command command arg))
-
-    (cond ((or (eq major-mode 'ditto-mode)
-               (string= popup-flag "switch"))
-           (switch-to-buffer buffer))
-          ((string= popup-flag "pop")
-           (pop-to-buffer buffer))
-          ((string= popup-flag "display")
-           (display-buffer buffer))
-          (t
-           (set-buffer buffer)))
-
-    (setq ditto-prev-line-number prev-line-number)
-    (set-process-sentinel
-     (get-buffer-process buffer)
-     '(lambda (process signal)
-        (when (string= signal "finished\n")
-          (with-current-buffer (process-buffer process)
-            (ditto-mode)
-            (goto-char (point-min))
-	    (and ditto-prev-line-number (goto-line ditto-prev-line-number)))))))))
+    (let* ((command-line (ditto-build-command command arg))
+           (output (ditto-daemon-call command arg)))
+      (unless output
+        (make-comint-in-buffer "ditto-call-process"
+                               buffer shell-file-name nil shell-command-switch
+                               command-line))
+
+      (cond ((or (eq major-mode 'ditto-mode)
+                 (string= popup-flag "switch"))
+             (switch-to-buffer buffer))
+            ((string= popup-flag "pop")
+             (pop-to-buffer buffer))
+            ((string= popup-flag "display")
+             (display-buffer buffer))
+            (t
+             (set-buffer buffer)))
+
+      (setq ditto-prev-line-number prev-line-number)
+      (if output
+          (with-current-buffer buffer
+            (insert output)
+            (ansi-color-apply-on-region (point-min) (point-max))
+            (ditto-finish-output))
+        (set-process-sentinel
+         (get-buffer-process buffer)
+         '(lambda (process signal)
+            (when (string= signal "finished\n")
+              (with-current-buffer (process-buffer process)
+                (ditto-finish-output))))))))))
+
+(defun ditto-finish-output ()
+  "Put the current ditto output buffer in ditto-mode, back on the line
+it was showing before."
+  (ditto-mode)
+  (goto-char (point-min))
+  (and ditto-prev-line-number (goto-line ditto-prev-line-number)))
+
+(defun ditto-command-output (command arg)
+  "Run a ditto command and return its output as a string."
+  (let ((command-line (ditto-build-command command arg)))
+    (or (ditto-daemon-call command arg)
+        (shell-command-to-string command-line))))
+
+(defun ditto-daemon-call (command arg)
+  "Run a ditto command in the daemon serving the last visited issue
+directory and return its output. Returns nil when no daemon is
+running or the command has to prompt, the command then has to run in
+a ditto process of its own. The daemon reads one json request line
+and answers with one json response line."
+  (let ((socket (expand-file-name ".issue-daemon.sock"
+                                  ditto-last-visited-issue-directory)))
+    (when (and ditto-use-daemon (file-exists-p socket))
+      (condition-case nil
+          (let* ((response "")
+                 (args (append (list command)
+                               (and arg (split-string arg))
+                               (list "-z" ditto-last-visited-issue-directory)))
+                 (proc (make-network-process
+                        :name "ditto-daemon" :family 'local :service socket
+                        :coding 'utf-8 :noquery t
+                        :filter (lambda (proc output)
+                                  (setq response (concat response output))))))
+            (unwind-protect
+                (progn
+                  (process-send-string
+                   proc (concat (json-encode (list (cons 'argv (vconcat args))
+                                                   (cons 'cwd (expand-file-name default-directory))))
+                                "\n"))
+                  (while (and (not (string-match "\n" response))
+                              (eq (process-status proc) 'open))
+                    (accept-process-output proc 1))
+                  (let ((result (json-read-from-string response)))
+                    (unless (cdr (assq 'interactive result))
+                      (concat (cdr (assq 'stdout result))
+                              (cdr (assq 'stderr result))))))
+              (delete-process proc)))
+        (error nil)))))
 
 (defvar ditto-last-visited-issue-directory nil)
 
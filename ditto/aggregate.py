@@ -0,0 +1,96 @@
+from array import array
+
+#Slots of an aggregate cell
+_EST_DONE = 0
+_EST_UNDONE = 1
+_ACTUAL_DONE = 2
+_CLOSED = 3
+_OPEN = 4
+_CELL_SIZE = 5
+
+def finish_statistics(est_done,est_undone,actual_done):
+    """Completes the (est_done,est_undone,actual_done,actual_undone) tuple,
+    extrapolating the remaining actual time from the work done so far"""
+    if est_done>0:
+        actual_undone = actual_done / est_done * est_undone
+    else:
+        actual_undone = est_undone
+
+    return(est_done,est_undone,actual_done,actual_undone)
+
+class IssueColumns:
+    """
+    The values the statistics need from every issue of a project, parsed once
+    and stored column wise: the release and owner of each issue as codes into
+    the releases and owners lists, whether it is closed, and its estimate and
+    actual time as floats.
+    """
+
+    def __init__(self,issues):
+        self.releases = []
+        self.owners = []
+        self.release = array('i')
+        self.owner = array('i')
+        self.closed = array('b')
+        self.estimate = array('d')
+        self.actual = array('d')
+        release_codes = {}
+        owner_codes = {}
+        for issue in issues:
+            release = issue.release
+            if release not in release_codes:
+                release_codes[release] = len(self.releases)
+                self.releases.append(release)
+            owner = issue.owner
+            if owner not in owner_codes:
+                owner_codes[owner] = len(self.owners)
+                self.owners.append(owner)
+            closed = issue.state == "closed"
+            self.release.append(release_codes[release])
+            self.owner.append(owner_codes[owner])
+            self.closed.append(closed)
+            self.estimate.append(issue.estimate)
+            self.actual.append(issue.actual if closed else 0.0)
+
+    def statistics(self):
+        """
+        Returns a dict of release name -> {owner -> statistics} for every
+        combination of release and owner that has issues, with "-" giving the
+        statistics of the whole release. Unassigned issues are under the ""
+        release. Everything is computed in a single sweep over the columns.
+        """
+        row_size = (len(self.owners)+1)*_CELL_SIZE
+        total_offset = len(self.owners)*_CELL_SIZE
+        cells = array('d',[0.0])*(len(self.releases)*row_size)
+        release, owner, closed = self.release, self.owner, self.closed
+        estimate, actual = self.estimate, self.actual
+        for i in xrange(len(release)):
+            row = release[i]*row_size
+            for cell in (row+owner[i]*_CELL_SIZE,row+total_offset):
+                if closed[i]:
+                    cells[cell+_EST_DONE] += estimate[i]
+                    cells[cell+_ACTUAL_DONE] += actual[i]
+                    cells[cell+_CLOSED] += 1
+                else:
+                    cells[cell+_EST_UNDONE] += estimate[i]
+                    cells[cell+_OPEN] += 1
+
+        statistics = {}
+        for release_code, release_name in enumerate(self.releases):
+            row = release_code*row_size
+            owners = statistics[release_name] = {}
+            for owner_code, owner_name in enumerate(self.owners+["-"]):
+                cell = row+owner_code*_CELL_SIZE
+                if cells[cell+_CLOSED] or cells[cell+_OPEN]:
+                    owners[owner_name] = _cell_statistics(cells,cell)
+        return statistics
+
+def _cell_statistics(cells,cell):
+    #sums with no issues behind them stay integer 0, as they always have
+    if cells[cell+_CLOSED]:
+        est_done = cells[cell+_EST_DONE]
+        actual_done = cells[cell+_ACTUAL_DONE]
+    else:
+        est_done = actual_done = 0
+    est_undone = cells[cell+_EST_UNDONE] if cells[cell+_OPEN] else 0
+    return finish_statistics(est_done,est_undone,actual_done)
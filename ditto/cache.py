@@ -0,0 +1,70 @@
+import json
+import os
+import storage
+
+INDEX_FILE = ".issue-index.json"
+INDEX_VERSION = 2
+
+class IssueIndex:
+    """
+    A persistent index of the issues folder. For every issue and release file
+    it remembers the modification time and size the file had when it was last
+    parsed, along with whatever the project wants to keep about it (the
+    folded current state of an issue, the json of a release). Files whose
+    mtime or size no longer match are simply parsed again, so the index never
+    has to be invalidated by hand. A missing, corrupt or out of date index is
+    treated as empty and rewritten.
+    """
+
+    def __init__(self,path):
+        self._path = path
+        self._entries = {}
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self._path):
+            return
+        try:
+            data = json.load(file(self._path))
+            if data.get("version") != INDEX_VERSION:
+                raise ValueError("index version mismatch")
+            self._entries = dict(data["files"])
+        except Exception:
+            self._entries = {}
+            self._dirty = True
+
+    def lookup(self,fname,stat):
+        """Returns the entry stored for fname if the file is unchanged"""
+        entry = self._entries.get(fname)
+        if entry is None:
+            return None
+        if entry["mtime"] != stat.st_mtime or entry["size"] != stat.st_size:
+            return None
+        return entry
+
+    def store(self,fname,stat,**data):
+        entry = dict(data)
+        entry["mtime"] = stat.st_mtime
+        entry["size"] = stat.st_size
+        self._entries[fname] = entry
+        self._dirty = True
+        return entry
+
+    def prune(self,fnames):
+        """Forget every file not in fnames"""
+        for fname in self._entries.keys():
+            if fname not in fnames:
+                del self._entries[fname]
+                self._dirty = True
+
+    def save(self):
+        """Writes the index if it has changed. The index is only a cache so
+        failing to write it (read only checkout, etc) is not an error."""
+        if not self._dirty:
+            return
+        try:
+            storage.atomic_write(self._path,json.dumps({"version":INDEX_VERSION,"files":self._entries}))
+            self._dirty = False
+        except (IOError,OSError):
+            pass
@@ -0,0 +1,15 @@
+"""
+The ditto command line entry point. It only imports what every command
+needs: the command is handed to a running daemon if there is one, otherwise
+execute_command imports the module defining it.
+"""
+import sys
+import daemon
+from command import execute_command
+
+def main():
+    if not daemon.run_remote(sys.argv[1:]):
+        execute_command()
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,51 @@
 import sys
 import argparse
-import tempfile
-import subprocess
 import os
 import issues
+import timings
 
 commands = {}
 
 default_command = None
 
+#The built in commands: (name, module, class, alternate names, description).
+#help lists these and execute_command imports only the module of the command
+#being run, so neither has to import every command. Keep it in step with
+#the command classes.
+REGISTRY = [
+    ("init","core","Init",[],"Initializes a new project."),
+    ("add","core","AddIssueCommand",[],"Add a new issue."),
+    ("remove","core","RemoveIssueCommand",[],"Remove an issue."),
+    ("close","core","CloseIssueCommand",[],"Close an issue."),
+    ("estimate","core","EstimateIssueCommand",[],"Change an issues time estimate."),
+    ("open","core","OpenIssueCommand",[],"Open an issue."),
+    ("show-issue","core","ShowIssueCommand",[],"Show issue "),
+    ("edit-issue","core","EditIssueCommand",[],"Edit a Issue "),
+    ("add-release","core","AddReleaseCommand",[],"Add a new release."),
+    ("assign-release","core","AssignReleaseCommand",[],"Assign an issue to a release."),
+    ("owner","core","AssignOwnerCommand",[],"Assign an issue an owner."),
+    ("release-description","core","DescribeReleaseCommand",[],"Edit a releases description."),
+    ("list","core","ListIssuesCommand",["ls"],"List all issues."),
+    ("release-summary","core","ReleaseSummaryCommand",["rs"],"Create a summary of a release."),
+    ("search","core","SearchCommand",[],"Search the titles and descriptions of issues."),
+    ("list-releases","core","ListReleasesCommand",["lsr"],"Lists the releases."),
+    ("get-guid","core","GetGuidForId",[],"Gets the guid for a specific issue id."),
+    ("migrate-storage","core","MigrateStorageCommand",[],"Converts all issue files to a storage format: json (an array of events) or jsonl (one event per line)"),
+    ("pack","core","PackCommand",[],"Moves the event logs of closed issues that no longer change into one pack file"),
+    ("import-db","core","ImportDatabaseCommand",[],"Builds the SQLite database from the issues folder and stores issues in it from then on"),
+    ("export-db","core","ExportDatabaseCommand",[],"Writes the SQLite database back to the json files of the issues folder"),
+    ("batch","core","BatchCommand",[],"Applies many add, close, open, estimate, owner and assign-release operations with one load and write"),
+    ("serve","core","ServeCommand",[],"Keeps the project loaded and runs the commands of other ditto processes until stopped"),
+    ("number-issues","core","NumberIssues",[],"System function: Sets unique numbers for all issues ONLY runnable by the master numbering server"),
+    ("help","command","HelpCommand",[],"Display this help file"),
+    ]
+
+#Cleared by the daemon, which has nobody to prompt
+interactive = True
+
+class NotInteractive(Exception):
+    """Raised when a command needs to prompt for a value but can not"""
+
 def register_command(cls):
     """Registers a command as usable"""
     commands[cls.command_name()] = cls
@@ -24,7 +61,7 @@ def set_default_command(cls):
 
 class Arg():
     """Definition for an argument. Used to specify the arguments for a Command"""
-    def __init__(self,name,switch,prompt="",type=str,default="",large=False):
+    def __init__(self,name,switch,prompt="",type=str,default="",large=False,flag=False,positional=False):
         self.name = name
         self.switch = switch
         self.prompt = prompt
@@ -33,6 +70,17 @@ class Arg():
         self.type = type
         self.default = default
         self.large=large
+        self.flag=flag
+        self.positional=positional
+
+    def switches(self):
+        """The command line switches for the argument, multi word names can
+        be given with either underscores or dashes"""
+        switches = ["--"+self.name]
+        if "_" in self.name:
+            switches.append("--"+self.name.replace("_","-"))
+        switches.append("-"+self.switch)
+        return switches
 
 class ValueList:
     def __init__(self,*args):
@@ -64,17 +112,21 @@ class Command():
     def __init__(self,argv):
         parser = self.setup_args()
 
-        self.setup_global_args()
+        self.setup_global_args(argv)
 
         args = parser.parse_args(argv)
+        #a positional argument given no values is missing, so it is prompted for
+        for arg in self.arguments:
+            if arg.positional and getattr(args,arg.name) == []:
+                setattr(args,arg.name,None)
         self.argument_values = args
 
-    def setup_global_args(self):
+    def setup_global_args(self,argv):
         """a bit hacky, need to set the issues config folder before
         the args parser tries to call anything."""
-        for i in range(len(sys.argv)):
-            if sys.argv[i] == "-z":
-                issues.set_issues_config_dir(sys.argv[i+1])
+        for i in range(len(argv)-1):
+            if argv[i] == "-z":
+                issues.set_issues_config_dir(argv[i+1])
 
     def setup_args(self):
         self.argument_map={}
@@ -82,17 +134,26 @@ class Command():
             self.argument_map[arg.name] = arg
         parser = argparse.ArgumentParser(description=self.description,prog="%s %s"%(sys.argv[0], self.command_name()))
         for arg in self.arguments + self.global_arguments:
-            parser.add_argument(*("--"+arg.name,"-"+arg.switch),**{"type":arg.type,"help":arg.prompt})
+            if arg.positional:
+                parser.add_argument(arg.name,**{"nargs":"*","default":None,"type":arg.type,"help":arg.prompt})
+            elif arg.flag:
+                parser.add_argument(*arg.switches(),**{"dest":arg.name,"action":"store_true","help":arg.prompt})
+            else:
+                parser.add_argument(*arg.switches(),**{"dest":arg.name,"type":arg.type,"help":arg.prompt})
         return parser
 
     def prompt_arg(self,name):
         """Prompt for the value of an argument"""
+        if not interactive:
+            raise NotInteractive(name)
         while True:
             try:
                 arg = self.argument_map[name]
                 if not arg.large:
                     raw_val = raw_input(arg.prompt+":")
                 else:
+                    import tempfile
+                    import subprocess
                     t = tempfile.NamedTemporaryFile(delete=False)
                     try:
                       editor = os.environ['EDITOR']
@@ -150,27 +211,99 @@ class HelpCommand(Command):
     def action(self):
         print "Available Commands:"
 
+        listed = set()
+        for command, module, class_name, alternate_names, description in REGISTRY:
+            listed.add(command)
+            self.print_command(command,alternate_names,description)
+        #commands registered by modules outside the registry
         for command, cls in commands.items():
-            if command == cls.command_name():
-                name = command
-                if len(cls.alternate_command_names())>0:
-                    name+=" ("+"".join(cls.alternate_command_names())+")"
-                print "  {0:<30}: {1}".format(name,cls.description)
+            if command == cls.command_name() and command not in listed:
+                self.print_command(command,cls.alternate_command_names(),cls.description)
+
+        print ""
+        print "Every command also takes:"
+        self.print_command("--timings",[],"Report the time and work of each phase of the command")
+        self.print_command("--profile FILE",[],"Run the command under cProfile, writing the statistics to FILE")
+
+    def print_command(self,command,alternate_names,description):
+        name = command
+        if len(alternate_names)>0:
+            name+=" ("+"".join(alternate_names)+")"
+        print "  {0:<30}: {1}".format(name,description)
+
+def find_command(name):
+    """Returns the command class for a command name or alternate name,
+    importing the module that defines it if it has not been, or None if
+    there is no such command"""
+    if name in commands:
+        return commands[name]
+    for command, module, class_name, alternate_names, description in REGISTRY:
+        if name == command or name in alternate_names:
+            return getattr(__import__(module,globals()),class_name)
+    return None
 
-def execute_command():
+def split_instrument_args(argv):
+    """Takes the --timings and --profile FILE options, which every command
+    accepts, out of argv. Returns (argv,timings,profile file)."""
+    remaining = []
+    show_timings = False
+    profile = None
+    i = 0
+    while i < len(argv):
+        if argv[i] == "--timings":
+            show_timings = True
+        elif argv[i] == "--profile" and i+1 < len(argv):
+            i += 1
+            profile = argv[i]
+        elif argv[i].startswith("--profile="):
+            profile = argv[i][len("--profile="):]
+        else:
+            remaining.append(argv[i])
+        i += 1
+    return remaining, show_timings, profile
+
+def execute_command(argv=None):
     """
     Executes a command the command name must be given as the first argument
-    with the command arguments following.
+    with the command arguments following. argv defaults to the arguments
+    ditto was run with.
+
+    With --timings the wall time and counters of each phase of the command
+    are written to stderr when it finishes, with --profile FILE it runs under
+    cProfile and the statistics are written to FILE (read them with pstats).
     """
+    if argv is None:
+        argv = sys.argv[1:]
+    argv, show_timings, profile = split_instrument_args(argv)
+
+    if show_timings:
+        timings.start()
+    try:
+        if profile is not None:
+            import cProfile
+            profiler = cProfile.Profile()
+            try:
+                profiler.runcall(_run_command,argv)
+            finally:
+                profiler.dump_stats(profile)
+        else:
+            _run_command(argv)
+    finally:
+        if show_timings:
+            timings.stop()
 
-    if len(sys.argv)==1:
+def _run_command(argv):
+    if len(argv)==0:
         default_command([]).action()
     else:
-        command_name = sys.argv[1]
-        if command_name in commands:
-            command = commands[command_name](sys.argv[2:])
-            command.action()
+        command_name = argv[0]
+        cls = find_command(command_name)
+        if cls is not None:
+            with timings.phase("arguments"):
+                command = cls(argv[1:])
+            with timings.phase("action"):
+                command.action()
         else:
-            print( "Unknown command: {0}".format(sys.argv[1]) )
+            print( "Unknown command: {0}".format(argv[0]) )
             print("")
             HelpCommand([]).action()
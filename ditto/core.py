@@ -1,11 +1,18 @@
 #!/usr/bin/python
-from command import Command,Arg,execute_command,register_command,ValueList
+from command import Command,Arg,register_command,find_command,ValueList
 import issues
-import tempfile
-import subprocess
+import storage
+import query
+import search
+import daemon
+import timings
+import json
 import os
 import sys
 
+#Argument type of the --format option of the commands that can write json
+RECORD_FORMAT = ValueList("text",*storage.RECORD_FORMATS)
+
 @register_command
 class Init(Command):
     name = "init"
@@ -140,13 +147,17 @@ class ShowIssueCommand(Command):
     description = "Show issue "
     arguments = [
         Arg("name", "n", "Issue to show: ", issues.issue_name),
+        Arg("format","f","output format: text (default), json or ndjson",RECORD_FORMAT),
         ]
 
     def action(self):
         project = issues.get_project()
         self.cond_prompt_arg("name")
         issue = project.get_issue(self.argument_values.name)
-        print(issue.detailed_summary())
+        if self.argument_values.format in storage.RECORD_FORMATS:
+            print(json.dumps(issue.record(detailed=True),cls=issues.DateEncoder,sort_keys=True))
+        else:
+            print(issue.detailed_summary())
 
 @register_command
 class EditIssueCommand(Command):
@@ -158,9 +169,14 @@ class EditIssueCommand(Command):
         ]
 
     def action(self):
+        import subprocess
         project = issues.get_project()
         self.cond_prompt_arg("name")
         issue = project.get_issue(self.argument_values.name)
+        if project.backend != "files":
+            print("Issues stored in a database can not be edited as files, export-db them first")
+            sys.exit(1)
+        project.unpack_issue(issue)
         file_name = issue._filename
         try:
             editor = os.environ['EDITOR']
@@ -232,6 +248,8 @@ class DescribeReleaseCommand(Command):
         ]
 
     def action(self):
+        import tempfile
+        import subprocess
         project = issues.get_project()
         self.cond_prompt_arg("release")
         release = project.get_release(self.argument_values.release)
@@ -258,20 +276,29 @@ class ListIssuesCommand(Command):
         Arg("display","d","issues to display (a) all,(o) open,(c) closed"),
         Arg("release","r","show only issues for a release",issues.release_name_or_blank),
         Arg("owner","o","show only issues for an owner",str),
+        Arg("query","q","show only issues matching a filter, e.g. \"state=open owner=james estimate>4 created>2011-01-01 title~regex\"",query.issue_query),
+        Arg("format","f","output format: text (default), json or ndjson",RECORD_FORMAT),
         ]
 
     def action(self):
+        issue_filter = self.argument_values.query or query.Query()
         display = self.argument_values.display
         if display == None:
-            display = 'o'
-        owner = self.argument_values.owner
-        
+            display = 'o' if self.argument_values.query is None else 'a'
+        if display != "a":
+            issue_filter.add("state","^",display[0])
+        if self.argument_values.release != None:
+            issue_filter.add("release","=",self.argument_values.release)
+        if self.argument_values.owner != None:
+            issue_filter.add("owner","=",self.argument_values.owner)
+
         project = issues.get_project()
-        for issue in project._issues:
-            if self.argument_values.release == None or self.argument_values.release == issue.release:
-                if display =="a" or (issue.state.lower()[0] == display.lower()[0]):
-                    if owner == None or owner.lower() == issue.owner.lower():
-                        print issue.summary()
+        if self.argument_values.format in storage.RECORD_FORMATS:
+            storage.write_records(sys.stdout,(issue.record() for issue in issue_filter.select(project)),
+                self.argument_values.format,cls = issues.DateEncoder)
+            return
+        for issue in issue_filter.select(project):
+            print issue.summary()
 
 @register_command
 class ReleaseSummaryCommand(Command):
@@ -281,73 +308,150 @@ class ReleaseSummaryCommand(Command):
 
     arguments = [
         Arg("release","r","show only issues for a release(or part of the name)",issues.release_name_or_blank),
-        Arg("format","f","output format",ValueList("dokuwiki","console"),default = "console"),
+        Arg("format","f","output format: console (default), dokuwiki, json or ndjson",ValueList("dokuwiki","console",*storage.RECORD_FORMATS),default = "console"),
+        Arg("all","a","write the dokuwiki pages of all releases and an index page to output_dir",flag=True),
+        Arg("output_dir","o","Directory to write the dokuwiki pages to"),
+        Arg("changed","c","with all, only republish releases affected by these changed issue/release files (comma separated)"),
+        Arg("revisions","v","with all, only republish releases affected by the issue/release files changed in this git revision range (old..new)"),
         ]
 
     def action(self):
+        if self.argument_values.all:
+            self.cond_prompt_arg("output_dir")
+            releases = None
+            project = issues.get_project()
+            if self.argument_values.revisions is not None:
+                files = git_changed_files(project,self.argument_values.revisions)
+                if files is None:
+                    sys.stderr.write("git diff of %s failed, republishing all releases\n" % self.argument_values.revisions)
+                else:
+                    releases = project.releases_affected_by(*files)
+            elif self.argument_values.changed is not None:
+                changed = [f for f in self.argument_values.changed.split(",") if f != ""]
+                releases = project.releases_affected_by(changed)
+            self.publish_all(self.argument_values.output_dir,releases)
+            return
         self.cond_prompt_arg("release")
         if self.argument_values.format == "dokuwiki":
             self.dokuwiki_output()
+        elif self.argument_values.format in storage.RECORD_FORMATS:
+            self.record_output()
         else:
             self.console_output()
 
+    def record_output(self):
+        """Writes the release, with its statistics, and its issues as json
+        records: a {"release": ..., "issues": [...]} object, or for ndjson a
+        line for the release followed by a line per issue. The release is
+        null (or left out) for the unassigned issues."""
+        project = issues.get_project()
+        if self.argument_values.release!="":
+            release = project.get_release(self.argument_values.release)
+            release_name = release.name()
+            release_record = release.record()
+            release_record["statistics"] = dict((owner,statistics_record(stats))
+                for owner, stats in release.owner_statistics().items())
+        else:
+            release_name = ""
+            release_record = None
+        records = (issue.record() for issue in project.issues_in_release(release_name))
+        if self.argument_values.format == "ndjson":
+            if release_record is not None:
+                storage.write_records(sys.stdout,[release_record],"ndjson",cls = issues.DateEncoder)
+            storage.write_records(sys.stdout,records,"ndjson",cls = issues.DateEncoder)
+        else:
+            sys.stdout.write('{"release": %s, "issues": ' % json.dumps(release_record,sort_keys=True))
+            storage.write_records(sys.stdout,records,"json",cls = issues.DateEncoder)
+            sys.stdout.write("}\n")
+
     def dokuwiki_output(self):
         project = issues.get_project()
         if self.argument_values.release!="":
             release = project.get_release(self.argument_values.release)
+        else:
+            release = None
+        sys.stdout.write(self.dokuwiki_page(project,release))
+
+    def publish_all(self,output_dir,releases=None):
+        """Writes the dokuwiki page of every release (or only of those named
+        in releases), and an index page linking them, to output_dir, which
+        is created if it does not exist. Pages
+        whose content has not changed are left untouched, the paths of the
+        pages written are printed."""
+        project = issues.get_project()
+        pages = []
+        index = ["======Releases======"]
+        for release in project.releases:
+            if releases is None or release.name() in releases:
+                pages.append((release.name(),self.dokuwiki_page(project,release)))
+            index.append("  * [["+release.name()+"]]")
+        pages.append(("index","\n".join(index)+"\n"))
+
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        for name, page in pages:
+            path = os.path.join(output_dir,name+".txt")
+            if write_if_changed(path,page):
+                print(path)
+
+    def dokuwiki_page(self,project,release):
+        """Returns the dokuwiki page for a release, or for the unassigned
+        issues if release is None"""
+        lines = []
+        out = lines.append
+        if release is not None:
             release_name = release.name()
-            print("====== {0} ======".format(release.name()))
+            out("====== {0} ======".format(release.name()))
 
-            stats = release.statistics()
-            print("\n**Totals:**")
-            print("  * Total Estimated Work: {0}h".format(stats[0]+stats[1]))
-            print("  * Estimated Work Completed: {0}h".format(stats[0]))
-            print("  * Actual Work Time: {0}h".format(stats[2]))
-            print("  * Estimated Remaining Work: {0}h".format(stats[1]))
-            print("  * Probable Remaining Time: {0}h".format(stats[3]))
+            all_stats = release.owner_statistics()
+            out("\n**Totals:**")
+            self.dokuwiki_statistics(all_stats["-"],out)
 
             for owner in release.owners():
-                stats = release.statistics(owner)
-                print("\n**{0}:**".format(owner))
-                print("  * Total Estimated Work: {0}h".format(stats[0]+stats[1]))
-                print("  * Estimated Work Completed: {0}h".format(stats[0]))
-                print("  * Actual Work Time: {0}h".format(stats[2]))
-                print("  * Estimated Remaining Work: {0}h".format(stats[1]))
-                print("  * Probable Remaining Time: {0}h".format(stats[3]))
+                out("\n**{0}:**".format(owner))
+                self.dokuwiki_statistics(all_stats[owner],out)
                 
-            print("===== Description =====")
-            print(release.description)
+            out("===== Description =====")
+            out(release.description)
         else:
             release_name = ""
-            print("====== {0} ======".format("Unassigned Issues"))
-
-        print("===== Issues =====")
-        print("==== Summary ====")
-        print "^ID ^Title ^ Owner ^ Status ^ Estimated Time(h) ^Actual Time(h) ^ "
-        for issue in project._issues:
-            if release_name == issue.release:
-                print("|[[#{id}|{id}]] |{title} |{owner} |{status} | {estimate} | {actual} |".format(id=issue.name,
-                    title=issue.title,
-                    status = issue.state,
-                    estimate = issue.estimate,
-                    owner = issue.owner,
-                    actual = issue.actual if issue.state == "closed" else " "))
+            out("====== {0} ======".format("Unassigned Issues"))
+
+        out("===== Issues =====")
+        out("==== Summary ====")
+        out("^ID ^Title ^ Owner ^ Status ^ Estimated Time(h) ^Actual Time(h) ^ ")
+        release_issues = project.issues_in_release(release_name)
+        timings.count("issues rendered",len(release_issues))
+        for issue in release_issues:
+            out("|[[#{id}|{id}]] |{title} |{owner} |{status} | {estimate} | {actual} |".format(id=issue.name,
+                title=issue.title,
+                status = issue.state,
+                estimate = issue.estimate,
+                owner = issue.owner,
+                actual = issue.actual if issue.state == "closed" else " "))
         
-        print("==== Descriptions ====")
-        for issue in project._issues:
-            if release_name == issue.release:
-                print("==={id}===".format(id=issue.name))
-                print("**{title}**".format(title = issue.title))
-                if issue.description!="":
-                    print("")
-                    print(issue.description)
-                print("")
-                if issue.owner !="":
-                    print("  * Owner:{0}".format(issue.owner))
-                print("  * Status:{0}".format(issue.state))
-                print("  * Estimate:{0}".format(issue.estimate))
-                if issue.state == "closed":
-                    print("  * Actual(h):{0}".format(issue.actual))
+        out("==== Descriptions ====")
+        for issue in release_issues:
+            out("==={id}===".format(id=issue.name))
+            out("**{title}**".format(title = issue.title))
+            if issue.description!="":
+                out("")
+                out(issue.description)
+            out("")
+            if issue.owner !="":
+                out("  * Owner:{0}".format(issue.owner))
+            out("  * Status:{0}".format(issue.state))
+            out("  * Estimate:{0}".format(issue.estimate))
+            if issue.state == "closed":
+                out("  * Actual(h):{0}".format(issue.actual))
+        return "\n".join(lines)+"\n"
+
+    def dokuwiki_statistics(self,stats,out):
+        out("  * Total Estimated Work: {0}h".format(stats[0]+stats[1]))
+        out("  * Estimated Work Completed: {0}h".format(stats[0]))
+        out("  * Actual Work Time: {0}h".format(stats[2]))
+        out("  * Estimated Remaining Work: {0}h".format(stats[1]))
+        out("  * Probable Remaining Time: {0}h".format(stats[3]))
 
     def console_output(self):
         project = issues.get_project()
@@ -360,13 +464,12 @@ class ReleaseSummaryCommand(Command):
             release_name = ""
             print("{0}".format("Unassigned Issues:"))
 
-        for issue in project._issues:
-            if release_name == issue.release:
-                print(issue.summary())
+        for issue in project.issues_in_release(release_name):
+            print(issue.summary())
 
         if self.argument_values.release!="":
-            release = project.get_release(self.argument_values.release)
-            stats = release.statistics()
+            all_stats = release.owner_statistics()
+            stats = all_stats["-"]
             print("\nOverall:")
             print("  * Total Estimated Work: {0}h".format(stats[0]+stats[1]))
             print("  * Estimated Work Completed: {0}h".format(stats[0]))
@@ -375,7 +478,7 @@ class ReleaseSummaryCommand(Command):
             print("  * Probable Remaining Time: {0}h".format(stats[3]))
         
             for owner in release.owners():
-                stats = release.statistics(owner)
+                stats = all_stats[owner]
                 print("\n{0}:".format(owner))
                 print("  * Total Estimated Work: {0}h".format(stats[0]+stats[1]))
                 print("  * Estimated Work Completed: {0}h".format(stats[0]))
@@ -383,6 +486,59 @@ class ReleaseSummaryCommand(Command):
                 print("  * Estimated Remaining Work: {0}h".format(stats[1]))
                 print("  * Probable Remaining Time: {0}h".format(stats[3]))
 
+def statistics_record(stats):
+    """Names the fields of a release statistics tuple"""
+    return {"estimate_done":stats[0],"estimate_remaining":stats[1],
+        "actual_done":stats[2],"actual_remaining":stats[3]}
+
+def git_changed_files(project,revisions):
+    """Returns the files of the issues folder changed in a git revision range
+    (old..new) and those of them that were added, or None if git fails"""
+    import subprocess
+    old, new = revisions.split("..")
+    try:
+        diff = subprocess.Popen(["git","diff","--name-status",old,new,"--",project._issue_folder],
+            cwd=project.get_root_folder(),stdout=subprocess.PIPE)
+    except OSError:
+        return None
+    output = diff.communicate()[0]
+    if diff.returncode != 0:
+        return None
+    changed = []
+    added = []
+    for line in output.splitlines():
+        fields = line.split("\t")
+        status = fields[0][:1]
+        if status in ("R","C"):
+            changed.append(fields[1])
+            changed.append(fields[2])
+            added.append(fields[2])
+        else:
+            changed.append(fields[1])
+            if status == "A":
+                added.append(fields[1])
+    return changed, added
+
+def write_if_changed(path,content):
+    """Writes content to path unless the file already holds exactly that
+    content (compared by hash). Returns whether the file was written."""
+    import hashlib
+    if isinstance(content,unicode):
+        content = content.encode("utf-8")
+    if os.path.exists(path):
+        stream = open(path,'rb')
+        try:
+            if hashlib.md5(stream.read()).digest() == hashlib.md5(content).digest():
+                return False
+        finally:
+            stream.close()
+    stream = open(path,'wb')
+    try:
+        stream.write(content)
+    finally:
+        stream.close()
+    return True
+
 def try_int(s):
     "Convert to integer if possible."
     try: return int(s)
@@ -393,12 +549,38 @@ def natsort_key(s):
     import re
     return map(try_int, re.findall(r'(\d+|\D+)', s))
 
+@register_command
+class SearchCommand(Command):
+    name = "search"
+    description= "Search the titles and descriptions of issues."
+    arguments = [
+        Arg("terms","t","Words to search for",positional=True),
+        Arg("limit","l","Maximum number of issues to show (default 20)",int),
+        ]
+
+    def action(self):
+        terms = self.cond_prompt_arg("terms")
+        if isinstance(terms,list):
+            terms = " ".join(terms)
+        limit = self.argument_values.limit or 20
+        project = issues.get_project()
+        index = search.SearchIndex(project.get_root_folder())
+        index.refresh(project)
+        try:
+            index.save()
+        except (IOError,OSError):
+            pass
+        for score, guid in index.search(terms)[:limit]:
+            print(project.get_issue_by_guid(guid).summary())
+
 @register_command
 class ListReleasesCommand(Command):
     name = "list-releases"
     description= "Lists the releases."
     alternate_names = ["lsr"]
-    arguments = [ ]
+    arguments = [
+        Arg("format","f","output format: text (default), json or ndjson",RECORD_FORMAT),
+        ]
     
     def action(self):
         project = issues.get_project()
@@ -406,6 +588,9 @@ class ListReleasesCommand(Command):
         def get_name(r):
             return natsort_key(r.name())
         releases.sort(key=get_name)
+        if self.argument_values.format in storage.RECORD_FORMATS:
+            storage.write_records(sys.stdout,(release.record() for release in releases),self.argument_values.format)
+            return
         for release in releases:
             print release.name()
 
@@ -421,6 +606,173 @@ class GetGuidForId(Command):
         issue = project.get_issue(self.argument_values.name)
         sys.stdout.write(issue._guid)
 
+@register_command
+class MigrateStorageCommand(Command):
+    name = "migrate-storage"
+    description= "Converts all issue files to a storage format: json (an array of events) or jsonl (one event per line)"
+    arguments = [
+        Arg("format","f","Storage format",ValueList(*storage.FORMATS)),
+        ]
+
+    def action(self):
+        project = issues.get_project()
+        if project.backend != "files":
+            print("Issues stored in a database have no files to convert")
+            sys.exit(1)
+        self.prompt_all_args()
+        storage_format = self.argument_values.format
+        converted = 0
+        for issue in project._issues:
+            #packed issues stay in the pack, writing them out would undo it
+            if issue._guid in project._packed:
+                continue
+            if issue._json and issue._stored_format != storage_format:
+                project.write_issue(issue,storage_format)
+                converted += 1
+        project.set_value("storage_format",storage_format)
+        project.save_project()
+        print("Converted {0} issues to {1}".format(converted,storage_format))
+
+@register_command
+class PackCommand(Command):
+    name = "pack"
+    description= "Moves the event logs of closed issues that no longer change into one pack file"
+    arguments = [
+        Arg("days","d","Only pack issues unchanged for this many days (default 30)",int),
+        ]
+
+    def action(self):
+        from datetime import datetime, timedelta
+        project = issues.get_project()
+        if project.backend != "files":
+            print("Issues stored in a database can not be packed")
+            sys.exit(1)
+        days = self.argument_values.days if self.argument_values.days is not None else 30
+        cutoff = str(datetime.now() - timedelta(days=days))
+        packed = []
+        added = 0
+        for issue in project._issues:
+            if issue._guid in project._packed:
+                packed.append(issue)
+            elif issue.state == "closed":
+                if str(issue._json[-1]["timestamp"]) <= cutoff:
+                    packed.append(issue)
+                    added += 1
+        project.write_pack(packed)
+        print("Packed {0} issues, {1} issues are in {2}".format(added,len(packed),issues.PACK_FILE))
+
+@register_command
+class ImportDatabaseCommand(Command):
+    name = "import-db"
+    description= "Builds the SQLite database from the issues folder and stores issues in it from then on"
+    arguments = []
+
+    def action(self):
+        import sqlstore
+        root_folder = issues.find_root_folder()
+        project = sqlstore.import_folder(root_folder)
+        print("Imported {0} issues and {1} releases into {2}".format(len(project._issues),len(project.releases),
+            sqlstore.database_path(root_folder,project._config)))
+
+@register_command
+class ExportDatabaseCommand(Command):
+    name = "export-db"
+    description= "Writes the SQLite database back to the json files of the issues folder"
+    arguments = [
+        Arg("switch","s","Store issues in the json files again from now on",flag=True),
+        ]
+
+    def action(self):
+        import sqlstore
+        root_folder = issues.find_root_folder()
+        project = sqlstore.export_folder(root_folder,self.argument_values.switch)
+        print("Exported {0} issues and {1} releases to {2}".format(len(project._issues),len(project.releases),
+            os.path.join(root_folder,project._issue_folder)))
+
+@register_command
+class BatchCommand(Command):
+    name = "batch"
+    description= "Applies many add, close, open, estimate, owner and assign-release operations with one load and write"
+    arguments = [
+        Arg("file","f","File of operations, one per line as they would follow 'ditto' (default: standard input)"),
+        ]
+
+    #The commands a batch can contain
+    operations = ("add","close","open","estimate","owner","assign-release")
+
+    def action(self):
+        project = issues.get_project()
+        if self.argument_values.file in (None,"-"):
+            lines = sys.stdin.readlines()
+        else:
+            lines = file(self.argument_values.file).readlines()
+        commands, errors = self.parse_operations(lines)
+        if errors:
+            for error in errors:
+                print(error)
+            print("Nothing was changed")
+            sys.exit(1)
+        project.defer_saves()
+        for command in commands:
+            command.action()
+        saved = project.flush_saves()
+        print("Applied {0} operations to {1} issues".format(len(commands),len(saved)))
+
+    def parse_operations(self,lines):
+        """Parses and validates every operation before any is applied, each
+        must give all the arguments of its command. Returns the commands and
+        a list of errors. Blank lines and # comments are skipped."""
+        import shlex
+        commands = []
+        errors = []
+        for number, line in enumerate(lines,1):
+            try:
+                argv = shlex.split(line,comments=True)
+            except ValueError as e:
+                errors.append("Line {0}: {1}".format(number,e))
+                continue
+            if not argv:
+                continue
+            if argv[0] not in self.operations:
+                errors.append("Line {0}: {1} can not be used in a batch".format(number,argv[0]))
+                continue
+            cls = find_command(argv[0])
+            try:
+                command = cls(argv[1:])
+            except SystemExit:
+                errors.append("Line {0}: invalid arguments".format(number))
+                continue
+            missing = [arg for arg in cls.arguments if getattr(command.argument_values,arg.name) is None]
+            if missing:
+                errors.append("Line {0}: missing {1}".format(number,", ".join("-"+arg.switch for arg in missing)))
+                continue
+            commands.append(command)
+        return commands, errors
+
+@register_command
+class ServeCommand(Command):
+    name = "serve"
+    description= "Keeps the project loaded and runs the commands of other ditto processes until stopped"
+    arguments = [
+        Arg("stop","s","Stop the running daemon",flag=True),
+        ]
+
+    def action(self):
+        import socket
+        root_folder = issues.find_root_folder()
+        if self.argument_values.stop:
+            try:
+                daemon.request(root_folder,{"shutdown":True})
+            except socket.error:
+                print("No ditto daemon is serving {0}".format(root_folder))
+            return
+        print("Serving {0} on {1}".format(root_folder,daemon.socket_path(root_folder)))
+        sys.stdout.flush()
+        try:
+            daemon.Daemon(root_folder).serve()
+        except KeyboardInterrupt:
+            pass
+
 @register_command
 class NumberIssues(Command):
     name = "number-issues"
@@ -432,12 +784,8 @@ class NumberIssues(Command):
         project.set_issue_master_names()
 
 def main():
-    execute_command()
-
-#def main():
-#    import cProfile
-#    cProfile.run('submain()', '/home/james/dittoprof')
-    
+    import cli
+    cli.main()
 
 if __name__ == "__main__":
     main()  
@@ -0,0 +1,195 @@
+import errno
+import json
+import os
+import sys
+import command
+import issues
+
+SOCKET_FILE = ".issue-daemon.sock"
+
+#socket (which loads ssl) and the modules only the daemon itself needs are
+#imported where they are used, so a ditto process that finds no daemon
+#running does not pay for them
+
+#Commands that start an editor, read standard input or set up or move a
+#project always run in the calling process
+LOCAL_COMMANDS = ("init","serve","edit-issue","release-description","batch","import-db","export-db")
+
+def socket_path(root_folder):
+    return os.path.join(root_folder,SOCKET_FILE)
+
+def _connect(path,timeout=None):
+    import socket
+    connection = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+    try:
+        connection.settimeout(timeout)
+        connection.connect(path)
+    except:
+        connection.close()
+        raise
+    return connection
+
+def request(root_folder,message):
+    """Sends one request to the daemon serving root_folder and returns its
+    response. Raises socket.error if no daemon is listening."""
+    import socket
+    connection = _connect(socket_path(root_folder),1.0)
+    try:
+        connection.settimeout(None)
+        connection.sendall(json.dumps(message)+"\n")
+        line = connection.makefile('rb').readline()
+    finally:
+        connection.close()
+    if not line:
+        raise socket.error(errno.ECONNRESET,"ditto daemon closed the connection")
+    return json.loads(line)
+
+def run_remote(argv):
+    """
+    Runs a command in the daemon serving the project, if one is running,
+    writing its output as if it had run here. Returns False when the command
+    has to run in this process instead: no daemon is listening, the command
+    starts an editor or it needs to prompt for a value.
+    """
+    if not argv or argv[0] in LOCAL_COMMANDS:
+        return False
+    for i in range(len(argv)-1):
+        if argv[i] == "-z":
+            root_folder = argv[i+1]
+            break
+    else:
+        try:
+            root_folder = issues.find_root_folder()
+        except Exception:
+            return False
+    if not os.path.exists(socket_path(root_folder)):
+        return False
+    import socket
+    try:
+        response = request(root_folder,{"argv":argv,"cwd":os.getcwd()})
+    except (socket.error,ValueError):
+        return False
+    if response.get("interactive"):
+        return False
+    sys.stdout.write(response["stdout"].encode("utf-8"))
+    sys.stderr.write(response["stderr"].encode("utf-8"))
+    if response["status"]:
+        sys.exit(response["status"])
+    return True
+
+def _text(output):
+    if isinstance(output,str):
+        return output.decode("utf-8","replace")
+    return output
+
+class Daemon:
+    """
+    Keeps the project of root_folder loaded and runs the commands clients
+    send over a Unix domain socket in the root folder, one at a time.
+
+    The protocol is line based json. A client connects, sends one request
+    line and reads one response line:
+
+        {"argv": ["list", "-r", "1.0"], "cwd": "/home/james/project"}
+        {"status": 0, "stdout": "...", "stderr": "..."}
+
+    The command runs in the working directory of the client, cwd, so
+    relative paths mean what they would have in the client.
+
+    A command that would have to prompt for a value answers
+    {"interactive": true} without doing anything, the client then runs it
+    itself. {"shutdown": true} stops the daemon.
+
+    Before each command the project is refreshed (see Project.refresh) with
+    the changes other processes made to the issues folder, or loaded again
+    if its storage moved (see issues.storage_changed).
+    """
+
+    def __init__(self,root_folder):
+        self._root_folder = root_folder
+        self._path = socket_path(root_folder)
+
+    def execute(self,argv,cwd=None):
+        """Runs a command in the resident project, capturing its output"""
+        import StringIO
+        import traceback
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout = StringIO.StringIO()
+        sys.stderr = StringIO.StringIO()
+        status = 0
+        own_cwd = os.getcwd()
+        try:
+            try:
+                if cwd is not None:
+                    os.chdir(cwd)
+                try:
+                    project = issues.get_project()
+                    if issues.storage_changed(project):
+                        #import-db or export-db --switch ran in another
+                        #process, load the project from its new storage
+                        issues.set_project(None)
+                    else:
+                        project.refresh()
+                except Exception:
+                    #a refresh that failed part way leaves the project out of
+                    #step with the folder, the next command loads it afresh
+                    issues.set_project(None)
+                    raise
+                command.execute_command(argv)
+            except command.NotInteractive:
+                return {"interactive":True}
+            except SystemExit as e:
+                status = e.code if isinstance(e.code,int) else 1
+            except Exception:
+                traceback.print_exc()
+                status = 1
+            output = sys.stdout.getvalue(), sys.stderr.getvalue()
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+            os.chdir(own_cwd)
+        return {"status":status,"stdout":_text(output[0]),"stderr":_text(output[1])}
+
+    def _listen(self):
+        import socket
+        if os.path.exists(self._path):
+            try:
+                _connect(self._path,1.0).close()
+            except socket.error:
+                os.remove(self._path)
+            else:
+                raise Exception("A ditto daemon is already serving %s" % self._root_folder)
+        server = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+        server.bind(self._path)
+        server.listen(5)
+        return server
+
+    def serve(self):
+        """Answers requests until asked to shut down"""
+        import socket
+        command.interactive = False
+        issues.get_project()
+        server = self._listen()
+        try:
+            while True:
+                connection, address = server.accept()
+                try:
+                    line = connection.makefile('rb').readline()
+                    message = json.loads(line)
+                    if message.get("shutdown"):
+                        connection.sendall(json.dumps({"status":0})+"\n")
+                        return
+                    connection.sendall(json.dumps(self.execute(message["argv"],message.get("cwd")))+"\n")
+                except Exception:
+                    #one bad request must not take the daemon down, tell the
+                    #client if it is still listening
+                    import traceback
+                    try:
+                        connection.sendall(json.dumps({"status":1,"stdout":"","stderr":_text(traceback.format_exc())})+"\n")
+                    except socket.error:
+                        pass
+                finally:
+                    connection.close()
+        finally:
+            server.close()
+            os.remove(self._path)
+            command.interactive = True
@@ -1,8 +1,12 @@
 import json
-import uuid
 import os
 import warnings
 from datetime import datetime
+import cache
+import storage
+import aggregate
+import search
+import timings
 
 warnings.simplefilter('ignore')
 
@@ -15,6 +19,8 @@ class DateEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, datetime):
             return str(obj)
+        if isinstance(obj, Event):
+            return obj.to_json()
         return json.JSONEncoder.default(self, obj)
 
 def create_project(folder,project_name,username,name,email):
@@ -32,75 +38,489 @@ def create_project(folder,project_name,username,name,email):
     except Exception as e:
         pass
 
+#Holds the event logs of closed issues moved out of their own files by the
+#pack command, see storage.Pack
+PACK_FILE = "issues.pack"
+
+#Issues are locked against other ditto processes while they are saved by
+#locking a byte of this file in the root folder, see storage.locked
+LOCK_FILE = ".issue-locks"
+
+#Below this many files to parse a process pool costs more than it saves,
+#see benchmarks/parallel_load.py
+PARALLEL_LOAD_THRESHOLD = 4000
+
 __project = None
 def get_project():
     """issues_config_dir only necessary if get_project has not
     been called at least once and the config file is in a non-standard
     location"""
     global __project
-    global _issues_config_dir
     if __project == None:
-        if _issues_config_dir is None:
-            root_dir = os.getcwd()
-            while not os.path.exists(os.path.join(root_dir,".issue-config.json")):
-                if len(root_dir) == 0:
-                    raise Exception("Couldn't find .issue-config.json in %s or its parents" % root_dir)
-                root_dir = os.sep.join(root_dir.split(os.sep)[:-1])
-        else:
-            if not os.path.exists(_issues_config_dir):
-                raise Exception("custom _issues_config_dir not found at %s" % _issues_config_dir)
-            if not os.path.exists(os.path.join(_issues_config_dir, ".issue-config.json")):
-                raise Exception("custom issues_config file not found in %s" % _issues_config_dir)
-            root_dir = _issues_config_dir
-        __project = Project(root_dir)
+        __project = open_project(find_root_folder())
     return __project
 
+def open_project(root_folder):
+    """Loads the project in root_folder from the storage its config names:
+    the json files of the issues folder, or with "storage": "sqlite" a
+    database (see sqlstore)"""
+    config = json.load(file(os.path.join(root_folder,".issue-config.json")))
+    if config.get("storage") == "sqlite":
+        import sqlstore
+        return sqlstore.SqliteProject(root_folder)
+    return Project(root_folder)
+
+#Config options that decide where a project's issues are stored, a project
+#loaded before one of them changed reads and writes the wrong storage
+STORAGE_OPTIONS = ("storage","folder","database")
+
+def storage_changed(project):
+    """Whether the config of project's root folder now stores issues
+    somewhere else than project was loaded from, see open_project"""
+    config = json.load(file(os.path.join(project.get_root_folder(),".issue-config.json")))
+    return any(config.get(option) != project._config.get(option) for option in STORAGE_OPTIONS)
+
+def set_project(project):
+    """Replaces the project returned by get_project, None to have it loaded
+    again on the next call"""
+    global __project
+    __project = project
+
+def find_root_folder():
+    """The folder holding .issue-config.json, either the custom issues config
+    dir or the current folder or its nearest parent containing one"""
+    if _issues_config_dir is None:
+        root_dir = os.getcwd()
+        while not os.path.exists(os.path.join(root_dir,".issue-config.json")):
+            if len(root_dir) == 0:
+                raise Exception("Couldn't find .issue-config.json in %s or its parents" % root_dir)
+            root_dir = os.sep.join(root_dir.split(os.sep)[:-1])
+    else:
+        if not os.path.exists(_issues_config_dir):
+            raise Exception("custom _issues_config_dir not found at %s" % _issues_config_dir)
+        if not os.path.exists(os.path.join(_issues_config_dir, ".issue-config.json")):
+            raise Exception("custom issues_config file not found in %s" % _issues_config_dir)
+        root_dir = _issues_config_dir
+    return root_dir
+
 class Project:
+    #Where issues are stored, see open_project
+    backend = "files"
+
     def __init__(self,root_folder):
-        config = json.load(file(os.path.join(root_folder,".issue-config.json")))
-        self._config = config
+        with timings.phase("load project"):
+            self._load(root_folder)
+
+    def _load(self,root_folder):
+        self._read_config(root_folder)
+        project_path = os.path.join(root_folder,self._issue_folder,"project.json")
+        self._project_stat = _file_stat(project_path)
+        self._json = json.load(file(project_path))
+        self._clear()
+        folder = os.path.join(root_folder,self._issue_folder)
+        with timings.phase("read index"):
+            index = cache.IssueIndex(os.path.join(root_folder,cache.INDEX_FILE))
+        with timings.phase("list folder"):
+            fnames = os.listdir(folder)
+            issue_files = []
+            unparsed = []
+            for fname in fnames:
+                path = os.path.join(folder,fname)
+                if fname.startswith("issue-") and fname.endswith(".json"):
+                    stat = os.stat(path)
+                    entry = index.lookup(fname,stat)
+                    issue_files.append((fname,path,stat,entry))
+                    if entry is None:
+                        unparsed.append(path)
+                elif fname.startswith("release-") and fname.endswith(".json"):
+                    guid = fname[8:-5]
+                    stat = os.stat(path)
+                    entry = index.lookup(fname,stat)
+                    if entry is None:
+                        entry = index.store(fname,stat,json=json.load(file(path)))
+                        timings.count("files read")
+                        timings.count("bytes parsed",stat.st_size)
+                    self._release_stats[guid] = (stat.st_mtime,stat.st_size)
+                    release = Release(project=self
+                        ,guid=guid
+                        ,json=entry["json"])
+                    self._releases.append(release)
+                    self._releases_by_name.setdefault(release.get_value("name"),release)
+                elif fname == PACK_FILE:
+                    stat = os.stat(path)
+                    self._pack_stat = (stat.st_mtime,stat.st_size)
+                    entry = index.lookup(fname,stat)
+                    if entry is None:
+                        entry = index.store(fname,stat,issues=self._open_pack().index())
+                    self._pack_index = entry["issues"]
+        with timings.phase("parse issues"):
+            parsed = dict(zip(unparsed,self._load_issue_files(unparsed)))
+            for fname, path, stat, entry in issue_files:
+                guid = fname[6:-5]
+                self._issue_stats[guid] = (stat.st_mtime,stat.st_size)
+                if entry is None:
+                    header, created, events, stored_format = parsed[path]
+                    index.store(fname,stat,state=header,created=created)
+                    if events is not None:
+                        issue = Issue(project=self,guid=guid,filename=path,json=events,stored_format=stored_format)
+                    else:
+                        issue = Issue(project=self,guid=guid,filename=path,snapshot=header,created=created)
+                else:
+                    issue = Issue(project=self,guid=guid,filename=path
+                        ,snapshot=entry["state"],created=entry["created"])
+                self._issues.append(issue)
+            loose = set(self._issue_stats)
+            for guid, (offset, length, created, header) in self._pack_index.iteritems():
+                if guid not in loose:
+                    self._packed[guid] = (offset,length)
+                    self._issue_stats[guid] = (self._pack_stat[0],offset)
+                    self._issues.append(Issue(project=self,guid=guid,filename=os.path.join(folder,"issue-"+guid+".json")
+                        ,snapshot=header,created=created))
+        with timings.phase("write index"):
+            index.prune(set(fnames))
+            index.save()
+
+        with timings.phase("sort issues"):
+            self._issues.sort(key=lambda issue: issue.get_creation_date())
+        self._reindex_issues()
+
+    def _read_config(self,root_folder):
+        config_path = os.path.join(root_folder,".issue-config.json")
+        self._config_stat = _file_stat(config_path)
+        self._config = json.load(file(config_path))
         self._root_folder = root_folder
-        self._issue_folder = config["folder"]
-        self._json = json.load(file(os.path.join(root_folder,self._issue_folder,"project.json")))
+        self._issue_folder = self._config["folder"]
+
+    def _clear(self):
+        """Sets up an empty project, no issues or releases and empty indexes"""
         self._issues = []
         self._releases = []
-        for fname in os.listdir(os.path.join(root_folder,self._issue_folder)):
-            if fname.startswith("issue-") and fname.endswith(".json"):
-                guid = fname[6:-5]
-                self._issues.append(Issue(project=self
-                    ,guid=guid
-                    ,filename = os.path.join(root_folder,self._issue_folder,fname)
-                    ,json=json.load(file(os.path.join(root_folder,self._issue_folder,fname)))))
-            elif fname.startswith("release-") and fname.endswith(".json"):
-                guid = fname[8:-5]
-                release = Release(project=self
-                    ,guid=guid
-                    ,json=json.load(file(os.path.join(root_folder,self._issue_folder,fname))))
-                self._releases.append(release)
+        self._issues_by_guid = {}
+        self._issue_stats = {}
+        self._release_stats = {}
+        self._issues_by_name = {}
+        self._issues_by_master_name = {}
+        self._issues_by_release = {}
+        self._issues_by_release_owner = {}
+        self._issues_by_state = {}
+        self._next_position = 0
+        self._statistics = None
+        self._releases_by_name = {}
+        self._resolved_releases = {}
+        self._deferred_saves = None
+        self._pack = None
+        self._pack_stat = None
+        self._pack_index = {}
+        self._packed = {}
 
-        self._issues.sort(key=lambda issue: issue.get_creation_date())
+    def _reindex_issues(self):
+        """Rebuilds every issue index from the issues in project order and
+        names the issues"""
+        with timings.phase("index issues"):
+            self._next_position = 0
+            self._issues_by_guid = {}
+            self._issues_by_master_name = {}
+            self._issues_by_release = {}
+            self._issues_by_release_owner = {}
+            self._issues_by_state = {}
+            for issue in self._issues:
+                self._index_issue(issue)
         self.set_issue_names()
 
+    def _index_issue(self,issue):
+        """Adds an issue to every index except the name index, which is
+        maintained by set_issue_names and rename_issue"""
+        issue._position = self._next_position
+        self._next_position += 1
+        self._issues_by_guid[issue._guid] = issue
+        _add_to_index(self._issues_by_master_name,issue.get_value("master_name"),issue)
+        self._index_groups(issue,issue._values,_add_to_index)
+
+    def _index_groups(self,issue,values,update):
+        """Adds (or removes, depending on update) an issue to the release,
+        release/owner and state indexes using the given issue values"""
+        release = values.get("release","")
+        state = values.get("state","open")
+        update(self._issues_by_release,release,issue)
+        update(self._issues_by_release_owner.setdefault(release,{}),values.get("owner",""),issue)
+        update(self._issues_by_state,state,issue)
+
+    def _load_issue_files(self,paths):
+        """
+        Parses issue files, returning (header,created,events,format) for
+        each. With the load_workers config option set above 1 and at least
+        parallel_load_threshold files to parse (when the index is cold) the
+        files are parsed in a pool of that many processes, 100 files at a
+        time. Only the headers come back from the pool, the issues then load
+        their event logs lazily like issues read from the index.
+        """
+        workers = int(self._config.get("load_workers",0))
+        threshold = int(self._config.get("parallel_load_threshold",PARALLEL_LOAD_THRESHOLD))
+        if workers > 1 and len(paths) >= threshold:
+            import multiprocessing
+            pool = multiprocessing.Pool(workers)
+            try:
+                return pool.map(_parse_issue_header,paths,100)
+            finally:
+                pool.close()
+                pool.join()
+        return [_parse_issue_file(path) for path in paths]
+
+    def json_layout(self):
+        """The layout files are written in, set by the json_layout config
+        option: pretty (the default) or compact"""
+        return self._config.get("json_layout","pretty")
+
+    def _write_json(self,fname,obj):
+        storage.atomic_write(os.path.join(self._root_folder,self._issue_folder,fname),
+            storage.dumps(obj,self.json_layout(),cls = DateEncoder))
+
     def save_project(self):
-        json.dump(self._json,
-            file(os.path.join(self._root_folder,self._issue_folder,"project.json"),'w'),cls = DateEncoder,indent=4)
+        self._write_json("project.json",self._json)
+
+    def storage_format(self):
+        """The format issue event logs are stored in, set in project.json by
+        the migrate-storage command: json (an array of events, the default)
+        or jsonl (one event per line)"""
+        return self.get_value("storage_format") or "json"
 
     def save_issue(self,issue):
-        json.dump(issue._json,
-            file(os.path.join(self._root_folder,self._issue_folder,"issue-"+issue._guid+".json"),'w'),cls = DateEncoder,indent=4)
+        """Writes an issue. With the issue locked its saved event log is read
+        again and only the events added since the issue was read are added
+        to it, so changes other processes saved meanwhile are kept (see
+        _merge_stored). When the file is already in the project's storage
+        format the new events are appended to it, for json files only if the
+        append_issue_events config option is yes. Otherwise the whole file is
+        replaced atomically. Between defer_saves and flush_saves the issue is
+        only noted for writing."""
+        if self._deferred_saves is not None:
+            if issue not in self._deferred_saves:
+                self._deferred_saves.append(issue)
+            return
+        path = self._issue_path(issue)
+        storage_format = self.storage_format()
+        with self._lock_issues([issue]):
+            stored_format = self._merge_stored(issue)
+            events = issue._json
+            appended = False
+            if stored_format == storage_format:
+                if storage_format == "jsonl":
+                    storage.append_lines(path,events[issue._saved_events:],cls = DateEncoder)
+                    appended = True
+                elif self._config.get("append_issue_events") == "yes":
+                    appended = storage.append_to_json_array(path,events[issue._saved_events:],self.json_layout(),cls = DateEncoder)
+            if not appended:
+                self._write_issue_file(issue,storage_format)
+            issue._saved_events = len(events)
+            stat = os.stat(path)
+            self._issue_stats[issue._guid] = (stat.st_mtime,stat.st_size)
+        search.journal_issue(self,issue)
+
+    def _lock_issues(self,issues,*others):
+        """Locks issues (and other keys, such as the pack file name) against
+        saves by other ditto processes for the duration of a with block"""
+        return storage.locked(os.path.join(self._root_folder,LOCK_FILE),[issue._guid for issue in issues]+list(others))
+
+    def _merge_stored(self,issue):
+        """
+        Reads the saved event log of a locked issue again. If other processes
+        added events since the issue was read they are put before the events
+        added here, which are still to be saved, and the issue takes the
+        values of the merged log. Returns the format the log is stored in,
+        None if the issue has not been saved.
+        """
+        events = issue._json
+        path = self._issue_path(issue)
+        if os.path.exists(path):
+            stored, stored_format = storage.load_events(path)
+        elif issue._guid in self._packed:
+            stored, stored_format = self._open_pack().events(*self._packed[issue._guid]), "pack"
+        else:
+            return None
+        if len(stored) != issue._saved_events:
+            new = events[issue._saved_events:]
+            self._reload_issue(issue,compact_events(stored)+new,stored_format)
+            issue._saved_events = len(stored)
+        return stored_format
+
+    def load_events(self,issue):
+        """Reads the event log of an issue, from its file or the pack,
+        returns (events,format)"""
+        packed = self._packed.get(issue._guid)
+        if packed is not None:
+            return self._open_pack().events(*packed), "pack"
+        return storage.load_events(issue._filename)
+
+    def _open_pack(self):
+        """The pack of the issues folder, mapped into memory when first
+        needed"""
+        if self._pack is None:
+            path = os.path.join(self._root_folder,self._issue_folder,PACK_FILE)
+            if _file_stat(path) != self._pack_stat:
+                raise Exception("%s changed while ditto was running, run the command again" % path)
+            self._pack = storage.Pack(path)
+        return self._pack
+
+    def _parse_packed(self,guid):
+        """Decodes a packed issue like _parse_issue_file does a file"""
+        events = self._open_pack().events(*self._packed[guid])
+        return issue_header(fold_events(events)), events[0]["timestamp"], compact_events(events), "pack"
+
+    def _close_pack(self):
+        if self._pack is not None:
+            self._pack.close()
+            self._pack = None
+
+    def write_pack(self,issues):
+        """
+        Replaces the pack with one holding the event logs of issues and then
+        removes their own files. Issues packed before and not given are
+        written to their own files first, so nothing is lost. Each issue keeps
+        being served from its own file, whenever it has one, over the packed
+        copy, so saving a packed issue (reopening it, say) simply writes its
+        file again. The pack and every issue in it, before or after, are
+        locked while it is written.
+        """
+        folder = os.path.join(self._root_folder,self._issue_folder)
+        path = os.path.join(folder,PACK_FILE)
+        guids = set(issue._guid for issue in issues)
+        unpacked = [self._issues_by_guid[guid] for guid in self._packed if guid not in guids]
+        with self._lock_issues(list(issues)+unpacked,PACK_FILE):
+            for issue in unpacked:
+                self.unpack_issue(issue)
+            for issue in issues:
+                self._merge_stored(issue)
+            entries = [(issue._guid,str(issue.get_creation_date()),issue_header(issue._values),issue._json)
+                for issue in issues]
+            if entries:
+                storage.atomic_write(path,storage.dumps_pack(entries,cls = DateEncoder))
+            elif os.path.exists(path):
+                os.remove(path)
+            self._close_pack()
+            self._pack_stat = _file_stat(path)
+            self._pack_index = self._open_pack().index() if entries else {}
+            for issue in issues:
+                if os.path.exists(self._issue_path(issue)):
+                    os.remove(self._issue_path(issue))
+                offset, length = self._pack_index[issue._guid][:2]
+                self._packed[issue._guid] = (offset,length)
+                self._issue_stats[issue._guid] = (self._pack_stat[0],offset)
+                issue._stored_format = "pack"
+                issue._saved_events = len(issue._json)
+
+    def unpack_issue(self,issue):
+        """Writes a packed issue to its own file, which overrides the packed
+        copy from then on"""
+        if issue._guid in self._packed:
+            issue._json
+            self.write_issue(issue,self.storage_format())
+
+    def issue_file_stat(self,issue):
+        """Returns the (mtime,size) of the file of an issue as last read or
+        written, None if it has not been saved"""
+        return self._issue_stats.get(issue._guid)
+
+    def _issue_path(self,issue):
+        return os.path.join(self._root_folder,self._issue_folder,"issue-"+issue._guid+".json")
+
+    def _issue_data(self,issue,storage_format):
+        """The full event log of an issue serialized in a storage format"""
+        if storage_format == "jsonl":
+            return storage.dumps_lines(issue._json,cls = DateEncoder)
+        return storage.dumps(issue._json,self.json_layout(),cls = DateEncoder)
+
+    def write_issue(self,issue,storage_format):
+        """Replaces the file of an issue with its full event log in the given
+        storage format, keeping the events other processes saved meanwhile"""
+        with self._lock_issues([issue]):
+            self._merge_stored(issue)
+            self._write_issue_file(issue,storage_format)
+            issue._saved_events = len(issue._json)
+
+    def _write_issue_file(self,issue,storage_format):
+        storage.atomic_write(self._issue_path(issue),self._issue_data(issue,storage_format))
+        self._packed.pop(issue._guid,None)
+        issue._stored_format = storage_format
+        self._issue_stats[issue._guid] = _file_stat(self._issue_path(issue))
+
+    def defer_saves(self):
+        """Makes save_issue only note the issues it is given until
+        flush_saves writes them"""
+        self._deferred_saves = []
+
+    def flush_saves(self):
+        """Writes the issues saved since defer_saves, each once and as one
+        group (see save_issues), and returns them"""
+        deferred, self._deferred_saves = self._deferred_saves, None
+        self.save_issues(deferred)
+        return deferred
+
+    def save_issues(self,issues):
+        """Writes several issues as a group with storage.atomic_write_many,
+        either all of the files are replaced or, if any of them can not be
+        written, none is. Files are rewritten in full in the project's
+        storage format, with every issue locked and its saved log merged as
+        save_issue does."""
+        storage_format = self.storage_format()
+        with self._lock_issues(issues):
+            for issue in issues:
+                self._merge_stored(issue)
+            storage.atomic_write_many([(self._issue_path(issue),self._issue_data(issue,storage_format))
+                for issue in issues])
+            for issue in issues:
+                self._packed.pop(issue._guid,None)
+                issue._stored_format = storage_format
+                issue._saved_events = len(issue._json)
+                self._issue_stats[issue._guid] = _file_stat(self._issue_path(issue))
+        for issue in issues:
+            search.journal_issue(self,issue)
 
     def save_release(self,release):
-        json.dump(release._json,
-            file(os.path.join(self._root_folder,self._issue_folder,"release-"+release._guid+".json"),'w'),cls = DateEncoder,indent=4)
+        self._write_json("release-"+release._guid+".json",release._json)
+        self._release_stats[release._guid] = _file_stat(os.path.join(self._root_folder,self._issue_folder,"release-"+release._guid+".json"))
 
     def set_issue_names(self):
-        ctr = 0
-        for issue in self._issues:            
-            ctr += 1
-            issue.name = issue.get_value("master_name")
-            if issue.name is None:
-                issue.name = "t_%s"%(ctr,)
-            
+        with timings.phase("name issues"):
+            ctr = 0
+            self._issues_by_name = {}
+            for issue in self._issues:
+                ctr += 1
+                issue.name = issue.get_value("master_name")
+                if issue.name is None:
+                    issue.name = "t_%s"%(ctr,)
+                _add_to_index(self._issues_by_name,issue.name,issue)
+
+    def rename_issue(self,issue,name):
+        """Changes the name of an issue keeping the name index up to date"""
+        _remove_from_index(self._issues_by_name,issue.name,issue)
+        issue.name = name
+        _add_to_index(self._issues_by_name,name,issue)
+
+    def issue_value_changed(self,issue,key,old_value,new_value):
+        """Called by an Issue whenever one of its values is set"""
+        if key in ("release","owner","state","estimate","actual"):
+            self._statistics = None
+        if key == "master_name":
+            _remove_from_index(self._issues_by_master_name,old_value,issue)
+            _add_to_index(self._issues_by_master_name,new_value,issue)
+        elif key in ("release","owner","state"):
+            old_values = dict(issue._values)
+            if old_value is None:
+                del old_values[key]
+            else:
+                old_values[key] = old_value
+            self._index_groups(issue,old_values,_remove_from_index)
+            self._index_groups(issue,issue._values,_add_to_index)
+
+    def release_value_changed(self,release,key,old_value,new_value):
+        """Called by a Release whenever one of its values is set"""
+        if key == "name":
+            if self._releases_by_name.get(old_value) is release:
+                del self._releases_by_name[old_value]
+            self._releases_by_name.setdefault(new_value,release)
+            self._resolved_releases = {}
+            self._statistics = None
+
     def set_issue_master_names(self):
 
         if "is_master_name_server" not in self._config or self._config["is_master_name_server"] != "yes":
@@ -119,30 +539,218 @@ class Project:
                     master_name_candidate_id += 1
                 issue.set_value("master_name", generate_master_name(master_name_candidate_id))
                 issue.set_value("master_name_server", self._config["master_name_server"])
-                issue.name = issue.get_value("master_name")
+                self.rename_issue(issue,issue.get_value("master_name"))
                 self.save_issue(issue)
                 master_name_candidate_id += 1
 
     def add_issue(self):
+        import uuid
         guid = str(uuid.uuid1())
         issue = Issue(project=self,guid=guid,json=[],filename="")
         self._issues.append(issue)
+        self._index_issue(issue)
+        self._statistics = None
+        issue.name = "t_%s"%(len(self._issues),)
+        _add_to_index(self._issues_by_name,issue.name,issue)
         return issue
 
     def add_release(self):
+        import uuid
         guid = str(uuid.uuid1())
         release = Release(project=self,guid=guid,json={})
         self._releases.append(release)
+        self._resolved_releases = {}
+        self._statistics = None
         return release
 
     def remove_issue(self,issue):
         try:
-            os.remove(os.path.join(self._root_folder,self._issue_folder,"issue-"+issue._guid+".json"))
+            with self._lock_issues([issue]):
+                in_pack = issue._guid in self._pack_index
+                if in_pack:
+                    self._packed.pop(issue._guid,None)
+                    self.write_pack([packed for packed in self._issues if packed._guid in self._packed])
+                path = os.path.join(self._root_folder,self._issue_folder,"issue-"+issue._guid+".json")
+                if os.path.exists(path) or not in_pack:
+                    os.remove(path)
         finally:
-            self._issues.remove(issue)
+            self._drop_issue(issue)
+            search.journal_issue(self,issue,removed=True)
+
+    def _drop_issue(self,issue):
+        """Takes an issue out of the project and its indexes, leaving its
+        file alone"""
+        self._issues.remove(issue)
+        del self._issues_by_guid[issue._guid]
+        self._issue_stats.pop(issue._guid,None)
+        self._packed.pop(issue._guid,None)
+        _remove_from_index(self._issues_by_name,issue.name,issue)
+        _remove_from_index(self._issues_by_master_name,issue.get_value("master_name"),issue)
+        self._index_groups(issue,issue._values,_remove_from_index)
+        self._statistics = None
+
+    def refresh(self):
+        """
+        Brings a long lived project up to date with the changes other
+        processes made to the issues folder since it was loaded or last
+        refreshed. Only the issue and release files whose mtime or size
+        changed are read (and the index of the pack if it changed, issues
+        whose packed copy moved are decoded again), new files are added and missing ones dropped, and
+        the indexes are updated as they go. Issues are renumbered only when
+        the creation order changed in a way that moves generated names.
+        Issues and releases added but not yet saved are kept. A file that
+        can not be parsed (caught half written) is read again on the next
+        refresh. Returns the set of changed file names.
+        """
+        folder = os.path.join(self._root_folder,self._issue_folder)
+        changed = self._refresh_config()
+        project_path = os.path.join(folder,"project.json")
+        if _file_stat(project_path) != self._project_stat:
+            self._project_stat = _file_stat(project_path)
+            self._json = json.load(file(project_path))
+            changed.add("project.json")
+
+        issue_stats = {}
+        release_stats = {}
+        for fname in os.listdir(folder):
+            if fname.startswith("issue-") and fname.endswith(".json"):
+                stats, guid = issue_stats, fname[6:-5]
+            elif fname.startswith("release-") and fname.endswith(".json"):
+                stats, guid = release_stats, fname[8:-5]
+            else:
+                continue
+            stat = _file_stat(os.path.join(folder,fname))
+            if stat is not None:
+                stats[guid] = stat
+        pack_stat = _file_stat(os.path.join(folder,PACK_FILE))
+        if pack_stat != self._pack_stat:
+            self._close_pack()
+            self._pack_stat = pack_stat
+            try:
+                self._pack_index = self._open_pack().index() if pack_stat is not None else {}
+            except (IOError,ValueError):
+                self._pack_stat = None
+                self._pack_index = {}
+            changed.add(PACK_FILE)
+        self._packed = {}
+        for guid, (offset, length, created, header) in self._pack_index.iteritems():
+            if guid not in issue_stats:
+                issue_stats[guid] = (self._pack_stat[0],offset)
+                self._packed[guid] = (offset,length)
+
+        renumber = False
+        for guid in self._issue_stats.keys():
+            if guid not in issue_stats:
+                issue = self._issues_by_guid[guid]
+                renumber = renumber or self._shifts_issue_names(issue)
+                self._drop_issue(issue)
+                changed.add("issue-"+guid+".json")
+        added = []
+        for guid, stat in issue_stats.iteritems():
+            if self._issue_stats.get(guid) == stat:
+                continue
+            path = os.path.join(folder,"issue-"+guid+".json")
+            try:
+                if guid in self._packed:
+                    header, created, events, stored_format = self._parse_packed(guid)
+                else:
+                    header, created, events, stored_format = _parse_issue_file(path)
+            except (IOError,ValueError,IndexError):
+                continue
+            changed.add("issue-"+guid+".json")
+            issue = self._issues_by_guid.get(guid)
+            if issue is not None and issue.get_creation_date() == created:
+                self._reload_issue(issue,events,stored_format)
+            else:
+                if issue is not None:
+                    renumber = renumber or self._shifts_issue_names(issue)
+                    self._drop_issue(issue)
+                added.append(Issue(project=self,guid=guid,filename=path,json=events,stored_format=stored_format))
+            self._issue_stats[guid] = stat
+        self._insert_issues(added,renumber)
+
+        releases_changed = False
+        for guid, stat in release_stats.iteritems():
+            if self._release_stats.get(guid) == stat:
+                continue
+            try:
+                release_json = json.load(file(os.path.join(folder,"release-"+guid+".json")))
+            except (IOError,ValueError):
+                continue
+            for release in self._releases:
+                if release._guid == guid:
+                    release._json = release_json
+                    break
+            else:
+                self._releases.append(Release(project=self,guid=guid,json=release_json))
+            self._release_stats[guid] = stat
+            changed.add("release-"+guid+".json")
+            releases_changed = True
+        for release in list(self._releases):
+            if release._guid in self._release_stats and release._guid not in release_stats:
+                self._releases.remove(release)
+                del self._release_stats[release._guid]
+                changed.add("release-"+release._guid+".json")
+                releases_changed = True
+        if releases_changed:
+            self._releases_by_name = {}
+            for release in self._releases:
+                self._releases_by_name.setdefault(release.get_value("name"),release)
+            self._resolved_releases = {}
+        if changed:
+            self._statistics = None
+        return changed
+
+    def _refresh_config(self):
+        """Reads .issue-config.json again if it changed, returns the set of
+        changed file names for refresh"""
+        changed = set()
+        config_path = os.path.join(self._root_folder,".issue-config.json")
+        if _file_stat(config_path) != self._config_stat:
+            self._config_stat = _file_stat(config_path)
+            self._config = json.load(file(config_path))
+            changed.add(".issue-config.json")
+        return changed
+
+    def _insert_issues(self,added,renumber=False):
+        """Adds issues found by refresh in creation order. Issues are only
+        reindexed when one lands before existing issues and only renamed
+        when renumber is set (an issue that shifted generated names was
+        dropped), otherwise each is indexed and named where it lands."""
+        reorder = False
+        added.sort(key=lambda issue: issue.get_creation_date())
+        for issue in added:
+            created = issue.get_creation_date()
+            position = len(self._issues)
+            while position > 0 and self._issues[position-1].get_creation_date() > created:
+                position -= 1
+            self._issues.insert(position,issue)
+            if position < len(self._issues)-1:
+                reorder = True
+            else:
+                self._index_issue(issue)
+                issue.name = issue.get_value("master_name") or "t_%s"%(position+1,)
+                _add_to_index(self._issues_by_name,issue.name,issue)
+        if reorder:
+            self._reindex_issues()
+        elif renumber:
+            self.set_issue_names()
+
+    def _reload_issue(self,issue,events,stored_format,snapshot=None):
+        """Replaces the values of an issue with those read again from its
+        file (or a snapshot of its header values), keeping the indexes up to
+        date"""
+        master_name = issue.get_value("master_name")
+        _remove_from_index(self._issues_by_master_name,master_name,issue)
+        self._index_groups(issue,issue._values,_remove_from_index)
+        issue._set_state(events,snapshot,stored_format)
+        _add_to_index(self._issues_by_master_name,issue.get_value("master_name"),issue)
+        self._index_groups(issue,issue._values,_add_to_index)
+        if issue.get_value("master_name") != master_name:
+            self.rename_issue(issue,issue.get_value("master_name") or "t_%s"%(self._issues.index(issue)+1,))
 
     def user_string(self):
-        return "%s (%s) <%s>"%(self._config["username"],self._config["name"],self._config["email"])
+        return _intern("%s (%s) <%s>"%(self._config["username"],self._config["name"],self._config["email"]))
 
     def get_value(self,key):
         return self._json.get(key,None)
@@ -162,17 +770,136 @@ class Project:
             return value in self._json[key]
 
     def get_issue(self,name):
-        for issue in self._issues:
-            if issue.name==name:
-                return issue
-        return None
+        issues = self._issues_by_name.get(name)
+        return issues[0] if issues else None
+
+    def get_issue_by_guid(self,guid):
+        return self._issues_by_guid.get(guid)
+
+    def get_issue_by_master_name(self,master_name):
+        issues = self._issues_by_master_name.get(master_name)
+        return issues[0] if issues else None
+
+    def get_release_by_name(self,name):
+        """Returns the release with exactly this name"""
+        return self._releases_by_name.get(name)
 
     def get_release(self,name):
+        """Matches a release name as typed on the command line: an exact
+        name, otherwise the first release starting with or, failing that,
+        containing name."""
+        release = self._releases_by_name.get(name)
+        if release is not None:
+            return release
+        for release in self._releases:
+            if release.name().startswith(name):
+                return release
         for release in self._releases:
             if release.name().find(name)!=-1:
                 return release
         return None
 
+    def resolve_release(self,value):
+        """Returns the release value stored on an issue if it names a release
+        and "" otherwise. Results are cached until the releases change."""
+        try:
+            return self._resolved_releases[value]
+        except KeyError:
+            resolved = value if self.is_release_name(value) else ""
+            self._resolved_releases[value] = resolved
+            return resolved
+
+    def issues_in_release(self,name,owner=None):
+        """Returns the issues (optionally only those of owner) assigned to
+        the release with exactly this name, or the unassigned issues if name
+        is "". Issues are returned in project order."""
+        if name != "":
+            if self.resolve_release(name) != name:
+                return []
+            keys = [name]
+        else:
+            keys = [key for key in self._issues_by_release if self.resolve_release(key) == ""]
+        found = []
+        for key in keys:
+            if owner is None:
+                found.extend(self._issues_by_release.get(key,[]))
+            else:
+                found.extend(self._issues_by_release_owner.get(key,{}).get(owner,[]))
+        if len(keys) > 1:
+            found.sort(key=lambda issue: issue._position)
+        return found
+
+    def issues_in_state(self,state):
+        return list(self._issues_by_state.get(state,[]))
+
+    def states(self):
+        """Returns the states issues are in"""
+        return self._issues_by_state.keys()
+
+    def issues_with_release_value(self,value):
+        """Returns the issues whose release is value as stored, which may be
+        part of a release name or name no release at all"""
+        return list(self._issues_by_release.get(value,[]))
+
+    def release_values(self):
+        """Returns the release values stored on issues"""
+        return self._issues_by_release.keys()
+
+    def release_owners(self,name):
+        """Returns the set of owners with issues in the release name"""
+        owners = set()
+        for issue in self.issues_in_release(name):
+            if issue.owner!="":
+                owners.add(issue.owner)
+        return owners
+
+    def statistics(self):
+        """Returns the statistics of every release and owner, see
+        aggregate.IssueColumns.statistics. They are computed once and kept
+        until an issue or release changes."""
+        if self._statistics is None:
+            self._statistics = aggregate.IssueColumns(self._issues).statistics()
+        return self._statistics
+
+    def releases_affected_by(self,fnames,added=()):
+        """
+        Returns the names of the releases whose summaries may have changed
+        because of changes to the given issue and release files, or None if
+        any release may have been affected. fnames are the changed files
+        (paths or file names), added those of them that are new.
+
+        A changed issue affects every release it has ever been assigned to
+        according to its event log, which covers the release it was moved
+        away from. Removed issues, added issues that shift the numbering of
+        later issues and changed releases affect everything.
+        """
+        affected = set()
+        added = set(os.path.basename(fname) for fname in added)
+        for fname in fnames:
+            fname = os.path.basename(fname)
+            if fname.startswith("issue-") and fname.endswith(".json"):
+                issue = self.get_issue_by_guid(fname[6:-5])
+                if issue is None:
+                    return None
+                if fname in added and self._shifts_issue_names(issue):
+                    return None
+                affected.add(issue.release)
+                for entry in issue._json:
+                    if entry["key"] == "release":
+                        affected.add(self.resolve_release(entry["value"]))
+            elif fname.startswith("release-") and fname.endswith(".json"):
+                return None
+            elif fname == PACK_FILE:
+                return None
+        return affected
+
+    def _shifts_issue_names(self,issue):
+        """Whether issue changes the generated name of a later issue"""
+        for later in self._issues[self._issues.index(issue)+1:]:
+            if later.get_value("master_name") is None:
+                return True
+        return False
+
     def get_root_folder(self):
         return self._root_folder
     
@@ -181,45 +908,184 @@ class Project:
         return self._releases
 
     def is_issue_name(self,name):
-        return self.get_issue(name) != None
+        return name in self._issues_by_name
 
     def is_release_name(self,name):
         return self.get_release(name) != None
 
+def _file_stat(path):
+    """The (mtime,size) of a file, None if it does not exist"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime,stat.st_size)
+
+def _add_to_index(index,key,issue):
+    """Indexes map a key to the list of issues sharing it, kept in project
+    order. None keys are not indexed."""
+    if key is None:
+        return
+    issues = index.setdefault(key,[])
+    position = len(issues)
+    while position > 0 and issues[position-1]._position > issue._position:
+        position -= 1
+    issues.insert(position,issue)
+
+def _remove_from_index(index,key,issue):
+    issues = index.get(key)
+    if issues is not None and issue in issues:
+        issues.remove(issue)
+        if not issues:
+            del index[key]
+
+#The values of an issue kept in the index, enough to list and summarize
+#issues without reading their event logs
+HEADER_KEYS = ("title","state","owner","estimate","actual","release","master_name","master_name_server")
+
+def issue_header(values):
+    header = {}
+    for key in HEADER_KEYS:
+        if key in values:
+            header[key] = values[key]
+    return header
+
+def _parse_issue_file(path):
+    events, stored_format = storage.load_events(path)
+    return issue_header(fold_events(events)), events[0]["timestamp"], compact_events(events), stored_format
+
+def _parse_issue_header(path):
+    header, created, events, stored_format = _parse_issue_file(path)
+    return header, created, None, None
+
+_interned = {}
+def _intern(string):
+    """Returns the one shared copy of string. Used for the strings repeated
+    across events, the built in intern does not take unicode."""
+    return _interned.setdefault(string,string)
+
+#Keys whose values come from a small set and are worth sharing
+_INTERNED_VALUE_KEYS = frozenset(["state","owner","release","estimate","actual","master_name_server"])
+
+class Event(object):
+    """
+    One entry of an issue's event log. Events are by far the most numerous
+    objects of a loaded project, so they have slots and share their key,
+    user and common values. They can still be read like the dicts they are
+    stored as, event["key"].
+    """
+    __slots__ = ("key","value","user","timestamp")
+
+    def __init__(self,key,value,user,timestamp):
+        self.key = _intern(key)
+        self.value = _intern(value) if key in _INTERNED_VALUE_KEYS else value
+        self.user = _intern(user)
+        self.timestamp = timestamp
+
+    def __getitem__(self,field):
+        if field not in Event.__slots__:
+            raise KeyError(field)
+        return getattr(self,field)
+
+    def to_json(self):
+        return {"key":self.key,"value":self.value,"user":self.user,"timestamp":self.timestamp}
+
+def compact_events(events):
+    """Turns the event dicts read from an issue file into Events. Entries
+    with other fields than an Event has are left as they are so nothing is
+    lost when the issue is written back."""
+    compacted = []
+    for entry in events:
+        if len(entry) == 4 and "key" in entry and "value" in entry and "user" in entry and "timestamp" in entry:
+            entry = Event(entry["key"],entry["value"],entry["user"],entry["timestamp"])
+        compacted.append(entry)
+    return compacted
+
+def fold_events(events):
+    """Folds an issue event log into a dict of the latest value of each key"""
+    timings.count("events scanned",len(events))
+    state = {}
+    for entry in events:
+        state[entry["key"]] = entry["value"]
+    return state
+
 def issue_name(name):
     if not get_project().is_issue_name(name):
         raise ValueError()
     return name
 
-class Issue:
+class Issue(object):
+    """
+    An issue, stored as an append only log of key/value events. The latest
+    value of each key is kept in a dict alongside the log so reading a
+    property does not have to scan the history. An issue can be created from
+    a cached snapshot of its header values (see HEADER_KEYS and
+    cache.IssueIndex), in which case the event log is only read from disk
+    when another value (the description, say), the history or an edit needs
+    it.
+    """
+    __slots__ = ("_guid","_events","_values","_header_only","_saved_events","_stored_format",
+        "_created","_project","_filename","_position","name")
+
     def __init__(self, *args, **kwargs):
         self._guid = kwargs["guid"]
-        self._json = kwargs["json"]
+        self._set_state(kwargs.get("json"),kwargs.get("snapshot"),kwargs.get("stored_format"))
+        self._created = kwargs.get("created")
         self._project = kwargs["project"]
         self._filename = kwargs["filename"]
-        self.properties = {
-            "title": str,
-            "description": str,
-            "release": release_name,            
-            "state": issue_state_name,
-            }
-    
+        self.name = None
+
+    def _set_state(self,events,snapshot,stored_format):
+        """Sets the issue from its event log, or when events is None from a
+        snapshot of its header values"""
+        self._events = events
+        self._saved_events = 0
+        self._stored_format = None
+        if events is not None:
+            self._values = fold_events(events)
+            self._header_only = False
+            self._saved_events = len(events)
+            self._stored_format = stored_format
+        else:
+            self._values = {}
+            for key, value in snapshot.items():
+                self._values[_intern(key)] = _intern(value) if key in _INTERNED_VALUE_KEYS else value
+            self._header_only = True
+
+    @property
+    def _json(self):
+        if self._events is None:
+            events, self._stored_format = self._project.load_events(self)
+            self._values = fold_events(events)
+            self._events = compact_events(events)
+            self._saved_events = len(self._events)
+            self._header_only = False
+        return self._events
 
     def set_value(self,key,value):
-        self._json.append({"key":key,"value":str(value),"user":self._project.user_string(),"timestamp":datetime.now()})
+        value = str(value)
+        self._json.append(Event(key,value,self._project.user_string(),datetime.now()))
+        old_value = self._values.get(key)
+        self._values[key] = value
+        self._project.issue_value_changed(self,key,old_value,value)
 
     def get_value(self,key,default=None):
-        value=default
-        for entry in self._json:
-            if entry["key"] == key:
-                value = entry["value"]
-        return value
+        if self._header_only and key not in HEADER_KEYS:
+            self._json
+        return self._values.get(key,default)
 
     def get_issue_name(self):
         return self.name
 
     def get_creation_date(self):
-        return self._json[0]["timestamp"]
+        """The timestamp of the first event as DateEncoder writes it, also
+        for issues created in this process, so creation dates compare"""
+        if self._created is not None:
+            return self._created
+        created = self._json[0]["timestamp"]
+        if isinstance(created,datetime):
+            return str(created)
+        return created
 
     @property
     def state(self):
@@ -243,15 +1109,30 @@ class Issue:
 
     @property
     def release(self):
-        release = self.get_value("release",default="")
-        return release if get_project().is_release_name(release) else ""
+        return self._project.resolve_release(self.get_value("release",default=""))
 
     @property
     def owner(self):
         owner = self.get_value("owner",default="")
         return owner
 
+    def record(self,detailed=False):
+        """The issue as a dict for machine readable output: its guid, name,
+        creation date and current values. The description, which needs the
+        event log of an issue read from the index, is only included when
+        detailed."""
+        timings.count("issues rendered")
+        record = {"guid":self._guid,"name":self.name,"created":self.get_creation_date(),
+            "title":self.title,"state":self.state,"owner":self.owner,"release":self.release,
+            "estimate":self.estimate,"actual":self.actual}
+        if self.get_value("master_name") is not None:
+            record["master_name"] = self.get_value("master_name")
+        if detailed:
+            record["description"] = self.description
+        return record
+
     def summary(self):
+        timings.count("issues rendered")
         owner = "({0:8})".format(self.owner) if self.owner!="" else "{0:10}".format("")
         if self.state=="open":
             return "\033[0m{0}\t(o):{1:<70} {2} e:{3}h\033[0m".format(self.name,self.title, owner, self.estimate)
@@ -284,16 +1165,14 @@ def not_release_name(name):
         raise ValueError()
     return name
 
-class Release:
+class Release(object):
+    __slots__ = ("_guid","_json","_project")
+
     def __init__(self, *args, **kwargs):
         self._guid = kwargs["guid"]
         self._json = kwargs["json"]
         self._project = kwargs["project"]        
-        self.properties = {
-            "name": str,
-            "description": str,
-            }
-        
+
     def name(self):
         return self._json["name"]
 
@@ -301,37 +1180,44 @@ class Release:
         return self._json.get(key,default)
 
     def set_value(self,key,value):
+        old_value = self._json.get(key)
         self._json[key] = value
+        self._project.release_value_changed(self,key,old_value,value)
+
+    def issues(self,owner=None):
+        return self._project.issues_in_release(self.name(),owner)
 
-    def issues(self):
-        return filter(lambda x: self.name() == x.release,get_project()._issues)
+    def record(self):
+        """The release as a dict for machine readable output"""
+        return {"guid":self._guid,"name":self.name(),"description":self.description}
 
     @property
     def description(self):
         return self.get_value("description","")
     
     def owners(self):
-        owners = set()
-        for issue in self.issues():
-            if issue.owner!="":
-                owners.add(issue.owner)
-        return owners
+        return self._project.release_owners(self.name())
 
     def statistics(self,owner="-"):
-        est_done = 0
-        est_undone = 0
-        actual_done = 0
-        for issue in self.issues():
-            if owner=="-" or issue.owner == owner:
-                if issue.state == "closed":
-                    est_done += float(issue.get_value("estimate",0))
-                    actual_done += float(issue.actual)
-                else:
-                    est_undone += float(issue.estimate)
+        return self.owner_statistics().get(owner,aggregate.finish_statistics(0,0,0))
 
-        if est_done>0:
-            actual_undone = actual_done / est_done * est_undone
-        else:
-            actual_undone = est_undone
+    def owner_statistics(self):
+        """Returns a dict of owner -> statistics for every owner in the
+        release, and "-" -> statistics for the whole release"""
+        statistics = self._project.statistics().get(self.name(),{})
+        if "-" not in statistics:
+            statistics = {"-":aggregate.finish_statistics(0,0,0)}
+        return statistics
+
+#The value types of issues and releases, shared by every instance
+Issue.properties = {
+    "title": str,
+    "description": str,
+    "release": release_name,            
+    "state": issue_state_name,
+    }
 
-        return(est_done,est_undone,actual_done,actual_undone)
+Release.properties = {
+    "name": str,
+    "description": str,
+    }
@@ -0,0 +1,141 @@
+import re
+import shlex
+
+#field op value, longest operators first so <= is not read as <
+_TERM = re.compile(r"^(\w+)(!=|<=|>=|=|<|>|~|\^)(.*)$")
+
+_NUMERIC_FIELDS = ("estimate","actual")
+
+#Fields that are not plain issue values
+_FIELDS = {
+    "name": lambda issue: issue.name,
+    "guid": lambda issue: issue._guid,
+    "created": lambda issue: str(issue.get_creation_date()),
+    "state": lambda issue: issue.state,
+    "release": lambda issue: issue.release,
+    "owner": lambda issue: issue.owner,
+    "title": lambda issue: issue.title,
+    "description": lambda issue: issue.description,
+    "estimate": lambda issue: issue.estimate,
+    "actual": lambda issue: issue.actual,
+    }
+
+class Term:
+    """
+    One condition of a query: field op value. Operators are = and != (equal,
+    ignoring case), <, <=, > and >= (numeric for estimate and actual, string
+    order otherwise, which suits the created timestamps), ~ (a regular
+    expression search, ignoring case) and ^ (starts with, ignoring case).
+    """
+
+    def __init__(self,field,op,value):
+        self.field = field
+        self.op = op
+        self.value = value
+        self.get = _FIELDS.get(field) or (lambda issue: issue.get_value(field,""))
+        self.test = self._compile_test()
+
+    def _compile_test(self):
+        op = self.op
+        if op == "~":
+            regex = re.compile(self.value,re.IGNORECASE)
+            return lambda value: regex.search(_text(value)) is not None
+        if op == "^":
+            prefix = _text(self.value).lower()
+            return lambda value: _text(value).lower().startswith(prefix)
+        if self.field in _NUMERIC_FIELDS:
+            expected = float(self.value)
+            convert = float
+        else:
+            expected = _text(self.value).lower()
+            convert = lambda value: _text(value).lower()
+        if op == "=":
+            return lambda value: convert(value) == expected
+        if op == "!=":
+            return lambda value: convert(value) != expected
+        if op == "<":
+            return lambda value: convert(value) < expected
+        if op == "<=":
+            return lambda value: convert(value) <= expected
+        if op == ">":
+            return lambda value: convert(value) > expected
+        return lambda value: convert(value) >= expected
+
+    def candidates(self,project):
+        """Returns the issues that can match this term read from the project
+        indexes, or None if the term can not be answered from an index"""
+        if self.op not in ("=","^"):
+            return None
+        if self.field == "state":
+            keys = [key for key in project.states() if self.test(key)]
+            return _merge([project.issues_in_state(key) for key in keys])
+        if self.field == "release":
+            #issue.release is the value as stored when it names a release,
+            #possibly by part of its name, and "" otherwise, so the stored
+            #values are tested as resolved rather than the release names
+            keys = [key for key in project.release_values() if self.test(project.resolve_release(key))]
+            return _merge([project.issues_with_release_value(key) for key in keys])
+        return None
+
+def _text(value):
+    if isinstance(value,str):
+        return value.decode("utf-8","replace")
+    return unicode(value)
+
+def _merge(lists):
+    """Merges lists of issues, each in project order, into one"""
+    if len(lists) == 1:
+        return lists[0]
+    merged = []
+    for issues in lists:
+        merged.extend(issues)
+    merged.sort(key=lambda issue: issue._position)
+    return merged
+
+class Query:
+    """A compiled filter expression, a conjunction of Terms"""
+
+    def __init__(self,terms=None):
+        self.terms = list(terms or [])
+
+    def add(self,field,op,value):
+        self.terms.append(Term(field,op,value))
+        return self
+
+    def matches(self,issue):
+        for term in self.terms:
+            if not term.test(term.get(issue)):
+                return False
+        return True
+
+    def select(self,project):
+        """Yields the matching issues of project in project order, as they
+        are found. The scan starts from the smallest set of issues any of the
+        terms can be answered with from the project indexes."""
+        candidates = project._issues
+        for term in self.terms:
+            found = term.candidates(project)
+            if found is not None and len(found) < len(candidates):
+                candidates = found
+        for issue in candidates:
+            if self.matches(issue):
+                yield issue
+
+def compile_query(text):
+    """Compiles an expression like "state=open owner=james estimate>4
+    created>2011-01-01 title~regex" into a Query. Values containing spaces
+    can be quoted. Raises ValueError for a malformed expression."""
+    query = Query()
+    for part in shlex.split(text):
+        match = _TERM.match(part)
+        if match is None:
+            raise ValueError("Invalid query term: %s" % part)
+        try:
+            query.add(*match.groups())
+        except re.error as e:
+            raise ValueError("Invalid regular expression in %s: %s" % (part,e))
+    return query
+
+def issue_query(text):
+    """Argument type for a query expression"""
+    return compile_query(text)
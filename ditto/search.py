@@ -0,0 +1,159 @@
+import json
+import math
+import os
+import re
+import storage
+
+SEARCH_FILE = ".issue-search.json"
+JOURNAL_FILE = ".issue-search-journal"
+SEARCH_VERSION = 1
+
+#Words in a title count this many times as much as words in a description
+TITLE_WEIGHT = 3
+
+#BM25 parameters
+K1 = 1.2
+B = 0.75
+
+_WORD = re.compile(r"\w+",re.UNICODE)
+
+def tokenize(text):
+    if isinstance(text,str):
+        text = text.decode("utf-8","replace")
+    return _WORD.findall(text.lower())
+
+def issue_terms(issue):
+    """Returns (length,{term:frequency}) for the current title and
+    description of an issue"""
+    terms = {}
+    length = 0
+    for text, weight in ((issue.title,TITLE_WEIGHT),(issue.description,1)):
+        for word in tokenize(text):
+            terms[word] = terms.get(word,0) + weight
+            length += weight
+    return length, terms
+
+class SearchIndex:
+    """
+    An inverted index over the current title and description of every issue,
+    stored in .issue-search.json next to .issue-config.json. Each document
+    records the mtime and size of the issue file it was built from so
+    refresh only re-reads issues that changed. Project.save_issue and
+    remove_issue append the change to a small journal file rather than
+    rewriting the index, the journal is folded in on the next search.
+    """
+
+    def __init__(self,root_folder):
+        self._path = os.path.join(root_folder,SEARCH_FILE)
+        self._journal_path = os.path.join(root_folder,JOURNAL_FILE)
+        self._docs = {}
+        self._postings = {}
+        self._total_length = 0
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        if os.path.exists(self._path):
+            try:
+                data = json.load(file(self._path))
+                if data.get("version") != SEARCH_VERSION:
+                    raise ValueError("search index version mismatch")
+                self._docs = data["docs"]
+                self._postings = data["postings"]
+                self._total_length = data["total_length"]
+            except Exception:
+                self._docs = {}
+                self._postings = {}
+                self._total_length = 0
+                self._dirty = True
+        if os.path.exists(self._journal_path):
+            for line in file(self._journal_path):
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get("removed"):
+                    self.remove(entry["guid"])
+                else:
+                    self.add(entry["guid"],entry["mtime"],entry["size"],entry["length"],entry["terms"])
+            self._dirty = True
+
+    def add(self,guid,mtime,size,length,terms):
+        self.remove(guid)
+        self._docs[guid] = [mtime,size,length,terms.keys()]
+        self._total_length += length
+        for term, frequency in terms.items():
+            self._postings.setdefault(term,{})[guid] = frequency
+        self._dirty = True
+
+    def remove(self,guid):
+        doc = self._docs.pop(guid,None)
+        if doc is None:
+            return
+        self._total_length -= doc[2]
+        for term in doc[3]:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(guid,None)
+                if not postings:
+                    del self._postings[term]
+        self._dirty = True
+
+    def refresh(self,project):
+        """Brings the index up to date with the issues of project, re-reading
+        only issues whose file changed since they were indexed"""
+        for issue in project._issues:
+            stat = project.issue_file_stat(issue)
+            if stat is None:
+                continue
+            doc = self._docs.get(issue._guid)
+            if doc is None or doc[0] != stat[0] or doc[1] != stat[1]:
+                length, terms = issue_terms(issue)
+                self.add(issue._guid,stat[0],stat[1],length,terms)
+        for guid in self._docs.keys():
+            if project.get_issue_by_guid(guid) is None:
+                self.remove(guid)
+
+    def search(self,text):
+        """Returns [(score,guid)] for the issues matching any word of text,
+        best first, ranked with BM25"""
+        if not self._docs:
+            return []
+        average_length = float(self._total_length) / len(self._docs) or 1.0
+        scores = {}
+        for term in set(tokenize(text)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (len(self._docs) - len(postings) + 0.5) / (len(postings) + 0.5))
+            for guid, frequency in postings.iteritems():
+                length = self._docs[guid][2]
+                scores[guid] = scores.get(guid,0.0) + idf * frequency * (K1 + 1) / (frequency + K1 * (1 - B + B * length / average_length))
+        ranked = [(score,guid) for guid, score in scores.iteritems()]
+        ranked.sort(reverse=True)
+        return ranked
+
+    def save(self):
+        """Writes the index, with the journal folded in, if it changed"""
+        if not self._dirty:
+            return
+        storage.atomic_write(self._path,json.dumps({"version":SEARCH_VERSION,"docs":self._docs,
+            "postings":self._postings,"total_length":self._total_length},separators=(",",":")))
+        if os.path.exists(self._journal_path):
+            os.remove(self._journal_path)
+        self._dirty = False
+
+def journal_issue(project,issue,removed=False):
+    """Records a saved or removed issue in the journal of the search index
+    of project. Nothing is recorded until the index has been built by a
+    first search."""
+    root_folder = project.get_root_folder()
+    if not os.path.exists(os.path.join(root_folder,SEARCH_FILE)):
+        return
+    if removed:
+        entry = {"guid":issue._guid,"removed":True}
+    else:
+        stat = project.issue_file_stat(issue)
+        length, terms = issue_terms(issue)
+        entry = {"guid":issue._guid,"mtime":stat[0],"size":stat[1],"length":length,"terms":terms}
+    storage.append_lines(os.path.join(root_folder,JOURNAL_FILE),[entry])
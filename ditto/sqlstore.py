@@ -0,0 +1,352 @@
+import json
+import os
+import sqlite3
+from contextlib import contextmanager
+import issues
+import storage
+import search
+import timings
+
+DATABASE_FILE = ".issue-db.sqlite"
+SCHEMA_VERSION = 1
+
+#issues holds the header values of each issue (see issues.HEADER_KEYS) as
+#json for loading and as columns for queries. Its version is the id of the
+#last event of the issue, ids only grow so refresh can find the issues
+#changed by other processes with version > the highest version it has seen.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS issues (guid TEXT PRIMARY KEY, created TEXT, master_name TEXT,
+    title TEXT, state TEXT, owner TEXT, release TEXT, estimate, actual,
+    header TEXT, version INTEGER, events INTEGER);
+CREATE INDEX IF NOT EXISTS issues_created ON issues (created);
+CREATE INDEX IF NOT EXISTS issues_master_name ON issues (master_name);
+CREATE INDEX IF NOT EXISTS issues_release ON issues (release, owner);
+CREATE INDEX IF NOT EXISTS issues_owner ON issues (owner);
+CREATE INDEX IF NOT EXISTS issues_state ON issues (state);
+CREATE INDEX IF NOT EXISTS issues_version ON issues (version);
+CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY AUTOINCREMENT, guid TEXT,
+    key TEXT, timestamp TEXT, entry TEXT);
+CREATE INDEX IF NOT EXISTS events_guid ON events (guid, id);
+CREATE INDEX IF NOT EXISTS events_timestamp ON events (timestamp);
+CREATE TABLE IF NOT EXISTS releases (guid TEXT PRIMARY KEY, name TEXT, json TEXT);
+CREATE INDEX IF NOT EXISTS releases_name ON releases (name);
+"""
+
+def database_path(root_folder,config):
+    """The database of a project, set by the database config option
+    (relative to the root folder), .issue-db.sqlite by default"""
+    return os.path.join(root_folder,config.get("database",DATABASE_FILE))
+
+def connect(path):
+    """Opens a database, creating its tables if they do not exist. Writes are
+    grouped with transaction, so the connection does not start transactions
+    of its own."""
+    db = sqlite3.connect(path,timeout=30,isolation_level=None)
+    db.executescript(SCHEMA)
+    if db.execute("SELECT value FROM meta WHERE key='schema'").fetchone() is None:
+        db.execute("INSERT INTO meta (key,value) VALUES ('schema',?)",(str(SCHEMA_VERSION),))
+    return db
+
+@contextmanager
+def transaction(db):
+    """Runs the enclosed statements as one transaction, taking the write
+    lock up front so concurrent writers queue rather than fail half way"""
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        yield db
+    except:
+        db.execute("ROLLBACK")
+        raise
+    db.execute("COMMIT")
+
+def _field(entry,name):
+    """A field of an event, Events and the raw dicts kept for entries with
+    other fields alike"""
+    try:
+        return entry[name]
+    except KeyError:
+        return None
+
+def _dumps(obj):
+    return json.dumps(obj,cls=issues.DateEncoder,separators=(",",":"))
+
+def _insert_events(db,guid,entries,version=0):
+    """Appends events to the log of an issue, returns the id of the last,
+    the new version of the issue"""
+    for entry in entries:
+        cursor = db.execute("INSERT INTO events (guid,key,timestamp,entry) VALUES (?,?,?,?)",
+            (guid,_field(entry,"key"),str(_field(entry,"timestamp")),_dumps(entry)))
+        version = cursor.lastrowid
+    return version
+
+def _write_issue_row(db,guid,created,values,version,count):
+    db.execute("INSERT OR REPLACE INTO issues (guid,created,master_name,title,state,owner,release,"
+        "estimate,actual,header,version,events) VALUES (?,?,?,?,?,?,?,?,?,?,?,?)",
+        (guid,str(created),values.get("master_name"),values.get("title"),values.get("state","open"),
+        values.get("owner",""),values.get("release",""),values.get("estimate"),values.get("actual"),
+        _dumps(issues.issue_header(values)),version,count))
+
+class SqliteProject(issues.Project):
+    """
+    A project whose issues, events and releases live in a SQLite database
+    rather than the json files of the issues folder, chosen with the
+    "storage": "sqlite" config option. Loading reads the header values of
+    every issue with one query in creation order, the event log of an issue
+    is read when it is needed like that of an issue read from the index
+    cache. Saving an issue inserts its new events and updates its header in
+    one transaction.
+
+    The issues folder is not touched, export-db writes the database back to
+    it and import-db reads it in, so the folder can still be kept in git.
+    """
+    backend = "sqlite"
+
+    def _load(self,root_folder):
+        self._read_config(root_folder)
+        self._clear()
+        self._db = connect(database_path(root_folder,self._config))
+        self._data_version = self._db.execute("PRAGMA data_version").fetchone()[0]
+        self._json = self._read_project_json()
+        with timings.phase("read releases"):
+            self._releases_json = {}
+            for guid, release_json in self._db.execute("SELECT guid,json FROM releases ORDER BY rowid"):
+                self._add_release(guid,json.loads(release_json))
+        with timings.phase("read issues"):
+            self._version = 0
+            for row in self._db.execute("SELECT guid,created,header,version,events FROM issues ORDER BY created,guid"):
+                self._issues.append(self._issue_from_row(row))
+        self._reindex_issues()
+
+    def _read_project_json(self):
+        row = self._db.execute("SELECT value FROM meta WHERE key='project'").fetchone()
+        return json.loads(row[0]) if row is not None else {}
+
+    def _add_release(self,guid,release_json):
+        release = issues.Release(project=self,guid=guid,json=release_json)
+        self._releases.append(release)
+        self._releases_json[guid] = release_json
+        self._releases_by_name.setdefault(release.get_value("name"),release)
+
+    def _issue_from_row(self,row):
+        guid, created, header, version, count = row
+        self._issue_stats[guid] = (version,count)
+        self._version = max(self._version,version)
+        return issues.Issue(project=self,guid=guid,filename="",snapshot=json.loads(header),created=created)
+
+    def load_events(self,issue):
+        rows = self._db.execute("SELECT entry FROM events WHERE guid=? ORDER BY id",(issue._guid,))
+        return [json.loads(entry) for (entry,) in rows], None
+
+    def save_project(self):
+        with transaction(self._db):
+            self._db.execute("INSERT OR REPLACE INTO meta (key,value) VALUES ('project',?)",(_dumps(self._json),))
+
+    def write_issue(self,issue,storage_format):
+        raise Exception("Issues stored in a database have no files to write, see export-db")
+
+    def save_issue(self,issue):
+        """Inserts the events added to an issue since it was read and updates
+        its header, in one transaction. Between defer_saves and flush_saves
+        the issue is only noted for writing."""
+        if self._deferred_saves is not None:
+            if issue not in self._deferred_saves:
+                self._deferred_saves.append(issue)
+            return
+        self.save_issues([issue])
+
+    def save_issues(self,issues):
+        """Saves several issues in one transaction"""
+        with transaction(self._db):
+            for issue in issues:
+                self._store_issue(issue)
+        for issue in issues:
+            search.journal_issue(self,issue)
+
+    def _store_issue(self,issue):
+        events = issue._json
+        guid = issue._guid
+        row = self._db.execute("SELECT events FROM issues WHERE guid=?",(guid,)).fetchone()
+        stored = row[0] if row is not None else 0
+        version = _insert_events(self._db,guid,events[issue._saved_events:],self._issue_stats.get(guid,(0,0))[0])
+        count = stored + len(events) - issue._saved_events
+        if stored == issue._saved_events:
+            values = issue._values
+            created = issue.get_creation_date()
+        else:
+            #another process added events since the issue was read, the
+            #header has to come from the whole log
+            log = self.load_events(issue)[0]
+            values = issues.fold_events(log)
+            created = log[0]["timestamp"]
+        _write_issue_row(self._db,guid,created,values,version,count)
+        issue._saved_events = len(events)
+        self._issue_stats[guid] = (version,count)
+
+    def save_release(self,release):
+        with transaction(self._db):
+            self._db.execute("INSERT OR REPLACE INTO releases (guid,name,json) VALUES (?,?,?)",
+                (release._guid,release.get_value("name"),_dumps(release._json)))
+        self._releases_json[release._guid] = release._json
+
+    def remove_issue(self,issue):
+        try:
+            with transaction(self._db):
+                self._db.execute("DELETE FROM events WHERE guid=?",(issue._guid,))
+                self._db.execute("DELETE FROM issues WHERE guid=?",(issue._guid,))
+        finally:
+            self._drop_issue(issue)
+            search.journal_issue(self,issue,removed=True)
+
+    def refresh(self):
+        """
+        Brings a long lived project up to date with the changes other
+        processes made to the database. Nothing is read unless the database
+        changed, then only the issues whose version is newer than any seen,
+        the list of issues if some were removed, and the releases. Returns
+        the set of changed issue and release file names, as they would be in
+        the issues folder.
+        """
+        changed = self._refresh_config()
+        data_version = self._db.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self._data_version:
+            return changed
+        self._data_version = data_version
+        project_json = self._read_project_json()
+        if project_json != self._json:
+            self._json = project_json
+            changed.add("project.json")
+
+        rows = self._db.execute("SELECT guid,created,header,version,events FROM issues WHERE version>?",
+            (self._version,)).fetchall()
+        renumber = False
+        stored = self._db.execute("SELECT count(*) FROM issues").fetchone()[0]
+        if stored < len(self._issue_stats) + len([row for row in rows if row[0] not in self._issue_stats]):
+            guids = set(guid for (guid,) in self._db.execute("SELECT guid FROM issues"))
+            for guid in self._issue_stats.keys():
+                if guid not in guids:
+                    issue = self._issues_by_guid[guid]
+                    renumber = renumber or self._shifts_issue_names(issue)
+                    self._drop_issue(issue)
+                    changed.add("issue-"+guid+".json")
+        added = []
+        for row in rows:
+            guid, created, header, version, count = row
+            self._version = max(self._version,version)
+            if self._issue_stats.get(guid) == (version,count):
+                continue
+            changed.add("issue-"+guid+".json")
+            issue = self._issues_by_guid.get(guid)
+            if issue is not None and issue.get_creation_date() == created:
+                self._reload_issue(issue,None,None,json.loads(header))
+                self._issue_stats[guid] = (version,count)
+            else:
+                if issue is not None:
+                    renumber = renumber or self._shifts_issue_names(issue)
+                    self._drop_issue(issue)
+                added.append(self._issue_from_row(row))
+        self._insert_issues(added,renumber)
+
+        releases_json = dict((guid,json.loads(release_json))
+            for guid, release_json in self._db.execute("SELECT guid,json FROM releases"))
+        unsaved = [release for release in self._releases if release._guid not in self._releases_json]
+        if releases_json != self._releases_json:
+            for guid in set(releases_json) ^ set(self._releases_json):
+                changed.add("release-"+guid+".json")
+            for guid in set(releases_json) & set(self._releases_json):
+                if releases_json[guid] != self._releases_json[guid]:
+                    changed.add("release-"+guid+".json")
+            self._releases = []
+            self._releases_json = {}
+            self._releases_by_name = {}
+            for guid, release_json in self._db.execute("SELECT guid,json FROM releases ORDER BY rowid"):
+                self._add_release(guid,json.loads(release_json))
+            for release in unsaved:
+                self._releases.append(release)
+                self._releases_by_name.setdefault(release.get_value("name"),release)
+            self._resolved_releases = {}
+        if changed:
+            self._statistics = None
+        return changed
+
+    def releases_affected_by(self,fnames,added=()):
+        #there are no files to have changed, every release may be affected
+        return None
+
+def import_folder(root_folder):
+    """
+    Builds the database of the project in root_folder from the json files of
+    its issues folder, replacing whatever the database held, and switches
+    the project to it. The new database is written beside the old one and
+    moved over it, so a failed import leaves the old one in place. Returns
+    the project read from the folder.
+    """
+    project = issues.Project(root_folder)
+    config = project._config
+    path = database_path(root_folder,config)
+    temporary = path+".import"
+    if os.path.exists(temporary):
+        os.remove(temporary)
+    db = connect(temporary)
+    try:
+        with transaction(db):
+            db.execute("INSERT OR REPLACE INTO meta (key,value) VALUES ('project',?)",(_dumps(project._json),))
+            for release in project.releases:
+                db.execute("INSERT INTO releases (guid,name,json) VALUES (?,?,?)",
+                    (release._guid,release.get_value("name"),_dumps(release._json)))
+            for issue in project._issues:
+                events = issue._json
+                version = _insert_events(db,issue._guid,events)
+                _write_issue_row(db,issue._guid,issue.get_creation_date(),issue._values,version,len(events))
+    finally:
+        db.close()
+    os.rename(temporary,path)
+    if config.get("storage") != "sqlite":
+        config["storage"] = "sqlite"
+        storage.atomic_write(os.path.join(root_folder,".issue-config.json"),json.dumps(config))
+    return project
+
+def export_folder(root_folder,switch=False):
+    """
+    Writes the database of the project in root_folder to the json files of
+    its issues folder, in the layout and storage format the project uses.
+    Only files whose content changed are rewritten and the issue and release
+    files of issues and releases no longer in the database are removed, as is
+    the pack file since every issue is written to its own file. With
+    switch the project goes back to storing issues in the files. Returns the
+    project read from the database.
+    """
+    config = json.load(file(os.path.join(root_folder,".issue-config.json")))
+    if not os.path.exists(database_path(root_folder,config)):
+        raise Exception("There is no database at %s to export, see import-db" % database_path(root_folder,config))
+    project = SqliteProject(root_folder)
+    folder = os.path.join(root_folder,project._issue_folder)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    storage_format = project.get_value("storage_format") or "json"
+    layout = project.json_layout()
+    files = {"project.json":storage.dumps(project._json,layout,cls=issues.DateEncoder)}
+    for release in project.releases:
+        files["release-"+release._guid+".json"] = storage.dumps(release._json,layout,cls=issues.DateEncoder)
+    for issue in project._issues:
+        if storage_format == "jsonl":
+            data = storage.dumps_lines(issue._json,cls=issues.DateEncoder)
+        else:
+            data = storage.dumps(issue._json,layout,cls=issues.DateEncoder)
+        files["issue-"+issue._guid+".json"] = data
+    changed = []
+    for fname, data in files.items():
+        path = os.path.join(folder,fname)
+        if not os.path.exists(path) or file(path,'rb').read() != data:
+            changed.append((path,data))
+    storage.atomic_write_many(changed)
+    for fname in os.listdir(folder):
+        if (fname.startswith("issue-") or fname.startswith("release-")) and fname.endswith(".json") and fname not in files:
+            os.remove(os.path.join(folder,fname))
+    if os.path.exists(os.path.join(folder,issues.PACK_FILE)):
+        os.remove(os.path.join(folder,issues.PACK_FILE))
+    if switch:
+        config = project._config
+        config.pop("storage",None)
+        storage.atomic_write(os.path.join(root_folder,".issue-config.json"),json.dumps(config))
+    return project
@@ -0,0 +1,257 @@
+import itertools
+import json
+import os
+from contextlib import contextmanager
+import timings
+
+LAYOUTS = ("pretty","compact")
+FORMATS = ("json","jsonl")
+RECORD_FORMATS = ("json","ndjson")
+
+def dumps(obj,layout="pretty",cls=None):
+    """Serializes obj in the given layout: pretty (indented, as ditto has
+    always written its files) or compact (no whitespace at all)"""
+    if layout == "compact":
+        return json.dumps(obj,cls=cls,separators=(",",":"))
+    elif layout == "pretty":
+        return json.dumps(obj,cls=cls,indent=4)
+    raise ValueError("Unknown json layout %s, expected one of %s" % (layout,", ".join(LAYOUTS)))
+
+def atomic_write(path,data):
+    """
+    Replaces the content of path with data. The data is written to a
+    temporary file in the same folder, synced to disk and then renamed over
+    path, so readers (and a crash) only ever see the old or the new file.
+    """
+    atomic_write_many([(path,data)])
+
+def atomic_write_many(files):
+    """
+    Replaces the content of several files, given as (path,data) pairs, as
+    a group. Every file is written and synced to a temporary file first and
+    only when all of them have been written are they renamed over the
+    originals, so a failure to write any of them changes nothing.
+    """
+    staged = []
+    try:
+        for path, data in files:
+            staged.append((_write_temporary(path,data),path))
+        for tmp_path, path in staged:
+            os.rename(tmp_path,path)
+    except:
+        for tmp_path, path in staged:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        raise
+
+def _write_temporary(path,data):
+    """Writes data to a synced temporary file next to path, with the mode
+    of path, and returns its name"""
+    import tempfile
+    folder = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(prefix="."+os.path.basename(path)+"-",dir=folder)
+    try:
+        stream = os.fdopen(fd,'wb')
+        try:
+            stream.write(data)
+            stream.flush()
+            os.fsync(stream.fileno())
+        finally:
+            stream.close()
+        if os.path.exists(path):
+            os.chmod(tmp_path,os.stat(path).st_mode & 0777)
+        else:
+            os.chmod(tmp_path,0666 & ~_umask())
+    except:
+        os.remove(tmp_path)
+        raise
+    return tmp_path
+
+def _umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+def append_to_json_array(path,items,layout="pretty",cls=None):
+    """
+    Appends items to the json array stored in path by overwriting its
+    closing bracket, without reading or rewriting the rest of the file.
+    Returns False, leaving the file untouched, if path does not end with a
+    non empty array.
+    """
+    if not items:
+        return True
+    stream = open(path,'r+b')
+    try:
+        stream.seek(0,os.SEEK_END)
+        end = stream.tell()
+        tail_start = max(0,end-64)
+        stream.seek(tail_start)
+        tail = stream.read().rstrip()
+        if not tail.endswith("]"):
+            return False
+        body = tail[:-1].rstrip()
+        if body == "" or body.endswith("["):
+            return False
+        stream.seek(tail_start+len(body))
+        stream.write(",\n"+",\n".join(dumps(item,layout,cls) for item in items)+"\n]")
+        stream.truncate()
+        stream.flush()
+        os.fsync(stream.fileno())
+        return True
+    finally:
+        stream.close()
+
+#path -> (open lock file, set of the byte slots this process holds)
+_held_locks = {}
+
+@contextmanager
+def locked(path,keys):
+    """
+    Holds exclusive locks on keys (issue guids, say) while the enclosed
+    block runs. Each key locks one byte of the lock file path, picked by a
+    hash of the key, with fcntl.lockf, so processes holding different keys
+    go ahead in parallel and those wanting the same key take turns (two keys
+    sharing a byte only means they take turns too). Keys are locked in byte
+    order so processes locking several keys at once can not deadlock. Locks
+    nest: a key already held by this process is not locked again and stays
+    locked until the block that first locked it ends. Without fcntl (on
+    Windows) nothing is locked.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    import zlib
+    if path not in _held_locks:
+        _held_locks[path] = (open(path,'ab'),set())
+    stream, held = _held_locks[path]
+    slots = sorted(set(zlib.crc32(str(key)) & 0x7fffffff for key in keys) - held)
+    taken = []
+    try:
+        for slot in slots:
+            fcntl.lockf(stream.fileno(),fcntl.LOCK_EX,1,slot)
+            held.add(slot)
+            taken.append(slot)
+        yield
+    finally:
+        for slot in taken:
+            fcntl.lockf(stream.fileno(),fcntl.LOCK_UN,1,slot)
+            held.discard(slot)
+        if not held:
+            del _held_locks[path]
+            stream.close()
+
+def dumps_lines(items,cls=None):
+    """Serializes items as json lines, one compact json document per line"""
+    return "".join(json.dumps(item,cls=cls,separators=(",",":"))+"\n" for item in items)
+
+def append_lines(path,items,cls=None):
+    """Appends items to the json lines file path"""
+    if not items:
+        return
+    stream = open(path,'ab')
+    try:
+        stream.write(dumps_lines(items,cls))
+        stream.flush()
+        os.fsync(stream.fileno())
+    finally:
+        stream.close()
+
+def write_records(stream,records,output_format,cls=None):
+    """Writes records to stream one at a time as they are produced, either
+    as a json array ("json") or as newline delimited json ("ndjson")"""
+    if output_format == "ndjson":
+        for record in records:
+            stream.write(json.dumps(record,cls=cls,sort_keys=True)+"\n")
+        return
+    separator = "["
+    for record in records:
+        stream.write(separator+"\n"+json.dumps(record,cls=cls,sort_keys=True))
+        separator = ","
+    stream.write("[]\n" if separator == "[" else "\n]\n")
+
+def load_events(path):
+    """
+    Reads an event log stored either as a json array or as json lines and
+    returns (events,format). Json lines are parsed one at a time as they are
+    read. A final line without a line end that does not parse is the
+    remains of an interrupted append and is ignored.
+    """
+    stream = open(path,'rb')
+    try:
+        first = stream.readline()
+        if first.lstrip().startswith("["):
+            data = first+stream.read()
+            timings.count("files read")
+            timings.count("bytes parsed",len(data))
+            return json.loads(data), "json"
+        events = []
+        size = 0
+        for line in itertools.chain([first],stream):
+            size += len(line)
+            if line.strip() == "":
+                continue
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                if line.endswith("\n"):
+                    raise
+        timings.count("files read")
+        timings.count("bytes parsed",size)
+        return events, "jsonl"
+    finally:
+        stream.close()
+
+#A pack holds the event logs of many issues in one file: a fixed size first
+#line giving the offset of the index, each event log as a line of compact
+#json and last the index, a json object of guid -> [offset, length, creation
+#date, header values] so issues can be listed without decoding their logs.
+PACK_MAGIC = "ditto-pack 1 "
+
+def dumps_pack(entries,cls=None):
+    """Serializes a pack from (guid,created,header,events) entries"""
+    lines = []
+    index = {}
+    offset = len(PACK_MAGIC)+17
+    for guid, created, header, events in entries:
+        data = json.dumps(events,cls=cls,separators=(",",":"))
+        index[guid] = [offset,len(data),created,header]
+        lines.append(data+"\n")
+        offset += len(data)+1
+    return "%s%016d\n%s%s\n" % (PACK_MAGIC,offset,"".join(lines),json.dumps(index,cls=cls,separators=(",",":"),sort_keys=True))
+
+class Pack:
+    """
+    Reads a pack file through a read only memory map, so only the index and
+    the event logs actually asked for are read and decoded.
+    """
+
+    def __init__(self,path):
+        import mmap
+        self._file = open(path,'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(),0,access=mmap.ACCESS_READ)
+        except:
+            self._file.close()
+            raise
+
+    def index(self):
+        header = self._map[:len(PACK_MAGIC)+17]
+        if not header.startswith(PACK_MAGIC):
+            raise ValueError("Not a ditto pack file")
+        offset = int(header[len(PACK_MAGIC):-1])
+        data = self._map[offset:]
+        timings.count("files read")
+        timings.count("bytes parsed",len(data))
+        return json.loads(data)
+
+    def events(self,offset,length):
+        """Decodes the event log stored at offset"""
+        timings.count("bytes parsed",length)
+        return json.loads(self._map[offset:offset+length])
+
+    def close(self):
+        self._map.close()
+        self._file.close()
@@ -0,0 +1,95 @@
+import sys
+import time
+from contextlib import contextmanager
+
+#The Timings being recorded, None unless a command runs with --timings. The
+#phase and count calls spread through the code check it first so they cost
+#next to nothing the rest of the time.
+_current = None
+
+#Counters in the order they are reported
+COUNTERS = ("files read","bytes parsed","events scanned","issues rendered")
+
+class Timings:
+    """
+    Wall time and counters per phase of a command. Phases nest, a phase
+    started inside another is reported indented below it and the counts are
+    added to the innermost phase. A phase entered several times (set_issue_names
+    after a refresh, say) is reported once with the number of calls.
+    """
+
+    def __init__(self):
+        self._phases = {}
+        self._order = []
+        self._stack = []
+        self._start = time.time()
+        self._outside = {}
+
+    def enter(self,name):
+        path = tuple(self._stack) + (name,)
+        if path not in self._phases:
+            self._phases[path] = {"elapsed":0.0,"calls":0,"counts":{}}
+            self._order.append(path)
+        self._stack.append(name)
+        return path
+
+    def leave(self,path,elapsed):
+        self._stack.pop()
+        phase = self._phases[path]
+        phase["elapsed"] += elapsed
+        phase["calls"] += 1
+
+    def count(self,counter,n):
+        if self._stack:
+            counts = self._phases[tuple(self._stack)]["counts"]
+        else:
+            counts = self._outside
+        counts[counter] = counts.get(counter,0) + n
+
+    def report(self,stream):
+        total = time.time() - self._start
+        totals = dict(self._outside)
+        stream.write("{0:<36} {1:>10} {2:>6}  {3}\n".format("phase","wall(ms)","calls","counts"))
+        for path in self._order:
+            phase = self._phases[path]
+            for counter, n in phase["counts"].items():
+                totals[counter] = totals.get(counter,0) + n
+            stream.write("{0:<36} {1:>10.2f} {2:>6}  {3}\n".format("  "*(len(path)-1)+path[-1],
+                phase["elapsed"]*1000,phase["calls"],_format_counts(phase["counts"])))
+        stream.write("{0:<36} {1:>10.2f} {2:>6}  {3}\n".format("total",total*1000,"",_format_counts(totals)))
+
+def _format_counts(counts):
+    ordered = [counter for counter in COUNTERS if counter in counts]
+    ordered += sorted(counter for counter in counts if counter not in COUNTERS)
+    return ", ".join("%s: %d" % (counter,counts[counter]) for counter in ordered)
+
+@contextmanager
+def phase(name):
+    """Times the enclosed block as the phase name when timings are on"""
+    timings = _current
+    if timings is None:
+        yield
+        return
+    path = timings.enter(name)
+    start = time.time()
+    try:
+        yield
+    finally:
+        timings.leave(path,time.time() - start)
+
+def count(counter,n=1):
+    """Adds n to a counter of the current phase when timings are on"""
+    if _current is not None:
+        _current.count(counter,n)
+
+def start():
+    global _current
+    _current = Timings()
+    return _current
+
+def stop(stream=None):
+    """Stops recording and writes the report, to stderr by default"""
+    global _current
+    timings, _current = _current, None
+    if timings is not None:
+        timings.report(stream or sys.stderr)
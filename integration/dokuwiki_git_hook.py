@@ -5,18 +5,18 @@
 import os
 import sys
 os.chdir("{Location to execute from}")
-from ditto import issues
 from ditto.core import ReleaseSummaryCommand
+from ditto import daemon
 target_dir = "{Location of dokuwiki pages namespace directory to publish to}"
 
-for release in issues.get_project().releases:
-    command = ReleaseSummaryCommand(["-r",release.name(),"-f","dokuwiki"])
-    sys.stdout = open(target_dir+release.name()+".txt",'w')
-    command.action()
-
-sys.stdout = open(target_dir+"index"+".txt",'w')
-print("======Releases======")
-for release in issues.get_project("{issues folder name}").releases:
-    print("  * [["+release.name()+"]]")
-sys.stdout = sys.__stdout__
-
+#Renders the release pages and the index in one go, only pages whose
+#content changed are rewritten. post-receive gets "<old> <new> <ref>" lines
+#on stdin, when a single existing ref was pushed only the releases affected
+#by the issue files changed in the push are rendered. If a ditto daemon is
+#serving the project the pages are rendered by it.
+args = ["--all","--output-dir",target_dir]
+updates = [line.split() for line in sys.stdin if line.strip()]
+if len(updates) == 1 and updates[0][0].strip("0") != "":
+    args += ["--revisions",updates[0][0]+".."+updates[0][1]]
+if not daemon.run_remote(["release-summary"]+args):
+    ReleaseSummaryCommand(args).action()
@@ -6,6 +6,6 @@ setup(
     
     entry_points="""
         [console_scripts]
-        ditto = ditto.core:main
+        ditto = ditto.cli:main
     """
 )